@@ -2,10 +2,20 @@
 BN constructs a bayesian network from Nodes.
 """
 
+import os
+import json
+import numpy as np
 import pandas as pd
+import heapq
+import itertools
 import matplotlib.pyplot as plt
-from collections import deque
-from tqdm import tqdm
+from collections import deque, OrderedDict
+from .Node import Node
+from . import inference
+from . import encoding
+from . import sampling
+from . import instrument
+from . import tables
 
 class BN(object):
     """
@@ -13,8 +23,23 @@ class BN(object):
     ----------
     ls_nodes : list of nodes
 
-    observations: pandas dataframe
-        dataframe, where each column represents a discrete random variable.
+    pseudo_count : float
+        dirichlet pseudo-count added to every cell of a node's family counts 
+        when its cpt is normalized, so unseen parent configurations get a 
+        smoothed rather than undefined distribution.
+
+    decay : float or None
+        if set, partial_fit() multiplies the counts gathered so far by decay 
+        before adding a new batch, so older observations fade out.
+
+    window : int or None
+        if set, partial_fit() only keeps the counts of the last window batches.
+
+    observations: pandas dataframe, encoding.Dataset, path or iterable
+        dataframe, where each column represents a discrete random variable, or
+        the same columns already encoded as an encoding.Dataset. a path to a 
+        csv, or an iterable of dataframe chunks (eg from pd.read_csv(..., 
+        chunksize=n)), is read one chunk at a time.
 
 
     attributes
@@ -24,26 +49,288 @@ class BN(object):
 
     dict_children : dictionary
         key represents node name, value is a list of its children names.
+
+    topological_order : list
+        every node, parents before children.
+
+    counts : dictionary
+        key represents node name, value is its family count table, of shape 
+        (parent cardinalities..., cardinality). these are the sufficient 
+        statistics that partial_fit() updates.
+
+
+    posterior_cache_size : int
+        number of posteriors predict() and predict_proba() keep across calls,
+        least recently used first out.
+
+    max_dense_size : int
+        families whose dense count table would have more cells than this are
+        counted and compiled as a tables.SparseTable, which only stores the
+        parent configurations that were observed.
     """
+
+    posterior_cache_size = 4096
+    max_dense_size = tables.MAX_DENSE_SIZE
     
-    def __init__(self, ls_nodes):
+    def __init__(self, ls_nodes, pseudo_count=0., decay=None, window=None):
         self.ls_nodes = ls_nodes  
+        self.pseudo_count = pseudo_count
+        self.decay = decay
+        self.window = window
         self.dict_nodes = self._generate_dict_nodes()  # dict for fast lookup
-        self.dict_children = self._generate_dict_children()
+        self._register()
+        self._build_index()
+        self.observations = None
+        self._reset_counts()
+        self._posteriors = OrderedDict()  # k = (target, evidence), v = posterior
+        self._tables_changed = False  # True if cached posteriors may be stale
         
 
-    def fit(self, observations):
+    @instrument.timed("fit")
+    def fit(self, observations, chunksize=100000):
+        """fit every node's cpt with joint observations, discarding any counts
+        gathered so far.
+
+        when observations is a dataframe or an encoding.Dataset (and the model
+        has no window), cpts are fit lazily: a node's family is only counted 
+        when its table is first needed, eg to sample, query or inspect its 
+        cpt, so working with a small part of a large network only pays for 
+        that part. refitting with a dataframe that shares columns with the 
+        previous one keeps the tables of families whose columns are 
+        unchanged. the dataframe is kept as self.observations, and must not 
+        be modified afterwards. each column is encoded once (see 
+        encoding.Dataset), when a family first needs it.
+
+        observations may also be a path to a csv (read chunksize rows at a 
+        time) or an iterable of dataframe chunks. each chunk is encoded once 
+        and added to every node's family count table, so peak memory is 
+        bounded by the chunk size rather than the size of the data.
+        """
+        if isinstance(observations, (pd.DataFrame, encoding.Dataset)) and self.window is None:
+            self._fit_lazy(observations)
+            return
+
+        # nodes still waiting to be fit lazily are compiled from the new 
+        # counts, rather than counted in the observations being replaced
+        self._reset_counts()
+        self._update(observations, chunksize)
+        if isinstance(observations, (pd.DataFrame, encoding.Dataset)):
+            self.observations = observations
+
+    def _fit_lazy(self, observations):
+        """record observations and mark the nodes whose family changed as 
+        stale, so their cpts are fit on first access.
+        """
+        dataset = observations
+        if not isinstance(dataset, encoding.Dataset):
+            dataset = encoding.Dataset(observations)
+        missing = [node.name for node in self.ls_nodes if node.name not in dataset.columns]
+        if missing:
+            raise ValueError("observations are missing columns: {}".format(missing))
+
+        # columns that are identical to the previous observations keep their codes
+        previous = self._dataset
+        unchanged = set()
+        if previous is not None and len(previous) == len(dataset):
+            unchanged = set(name for name in self.dict_nodes if name in previous.columns 
+                            and previous.equals(dataset, name))
+        kept = dict((name, (previous.codes(name), previous.states[name])) 
+                    for name in unchanged if name in previous.states)
+        kept_counts = dict((name, counts) for (name, counts) in self.counts.items() 
+                           if self.dict_nodes[name]._source is self 
+                           and not self.dict_nodes[name]._stale
+                           and set(self.dict_nodes[name].parents_names + [name]) <= unchanged)
+
+        self._reset_counts()
         self.observations = observations
-        self._generate_cpt()  # compute cpt for each node - no lazy loading 
+        self._dataset = dataset
+        for (name, (codes, states)) in kept.items():
+            dataset.add(name, codes, states)
+            self._states[name] = states
+        self.counts = kept_counts  # the other families are counted on demand
+
+        for node in self.ls_nodes:
+            if node.name not in kept_counts:
+                node._invalidate(self, states=node.name not in kept)
+
+    @instrument.timed("partial_fit")
+    def partial_fit(self, observations, chunksize=100000):
+        """update every node's cpt with a new batch of joint observations.
+
+        only the family count tables are updated, so the cost depends on the 
+        size of the batch rather than on the observations seen before. if the
+        model has a decay, earlier counts are scaled down first; if it has a 
+        window, counts from batches older than the window are subtracted.
+        """
+        self._materialize()
+        self._update(observations, chunksize)
+
+    def _update(self, observations, chunksize):
+        """count a batch of observations and add it to the counts, then 
+        recompile every cpt.
+        """
+        self.observations = None  # counts no longer come from one dataframe
+        if self._dataset is not None:
+            # new chunks add states, which must not leak into the dataset
+            self._states = dict((name, dict(states)) for (name, states) in self._states.items())
+            self._dataset = None
+
+        if isinstance(observations, (pd.DataFrame, encoding.Dataset)):
+            chunks = [observations]
+        else:
+            chunks = self._chunks(observations, chunksize)
 
+        # count the batch on its own, so it can leave the window later
+        batch = dict((node.name, np.zeros([0] * (len(node.ls_parents) + 1))) 
+                     for node in self.ls_nodes)
+        for chunk in chunks:
+            self._accumulate(chunk, batch)
 
+        if self.decay is not None:
+            self._scale_counts(self.decay)
+        self._add_counts(batch, 1.)
+
+        if self.window is not None:
+            self._batches.append(batch)
+            while len(self._batches) > self.window:
+                self._add_counts(self._batches.popleft(), -1.)
+
+        self._generate_cpt()
+
+    def _reset_counts(self):
+        """forget every state and count seen so far.
+        """
+        self._states = dict((node.name, {}) for node in self.ls_nodes)
+        self.counts = dict((node.name, np.zeros([0] * (len(node.ls_parents) + 1))) 
+                           for node in self.ls_nodes)
+        self._batches = deque()  # per-batch counts, when windowed
+        self._dataset = None  # encoded observations, when fit lazily
+
+    def _scale_counts(self, factor):
+        """multiply the counts, and the per-batch counts in the window, by factor.
+        """
+        for name in self.counts:
+            self.counts[name] = self.counts[name] * factor
+        for batch in self._batches:
+            for name in batch:
+                batch[name] = batch[name] * factor
+
+    def _add_counts(self, batch, sign):
+        """add (sign=1) or subtract (sign=-1) a batch's counts from the counts.
+        """
+        for (name, counts) in batch.items():
+            total = tables.add(self.counts[name], counts, sign)
+            self.counts[name] = total.clip(0)  # clip rounding error
+
+    def _chunks(self, observations, chunksize):
+        """return an iterable of dataframe chunks, reading only the columns of
+        the network's nodes (that are present) when observations is a path.
+        """
+        if isinstance(observations, str):
+            names = [node.name for node in self.ls_nodes]
+            return pd.read_csv(observations, usecols=lambda c: c in names, chunksize=chunksize)
+        return observations
+
+    @instrument.timed("fit.count")
+    def _accumulate(self, chunk, counts):
+        """encode a chunk of observations (a dataframe or an encoding.Dataset) 
+        and add it to every node's family count table in counts.
+        """
+        if not isinstance(chunk, encoding.Dataset):
+            chunk = encoding.Dataset(chunk)
+        missing = [node.name for node in self.ls_nodes if node.name not in chunk.columns]
+        if missing:
+            raise ValueError("observations are missing columns: {}".format(missing))
+
+        # encode each column once, shared by every family that contains it
+        codes = dict((name, chunk.recode(name, states)) 
+                     for (name, states) in self._states.items())
+
+        for node in self.ls_nodes:
+            family = node.parents_names + [node.name]
+            cards = [len(self._states[name]) for name in family]
+            table = tables.count([codes[name] for name in family], cards, self.max_dense_size)
+            counts[node.name] = tables.add(counts[node.name], table)
+        instrument.count("rows_counted", len(chunk))
+
+    @instrument.timed("fit.cpt")
     def _generate_cpt(self):
         """iterate through all nodes and compute their respective conditional 
-        probability tables.
+        probability tables by normalizing their family counts.
+        """
+        for node in self.ls_nodes:
+            self._compile_family(node)
+
+    def _compile_family(self, node):
+        """compile a node's cpt by normalizing its family counts.
+
+        states are sorted, so codes do not depend on the order observations 
+        arrive in. parent configurations that were never observed get a 
+        uniform distribution, or the smoothed one if there is a pseudo-count.
+        """
+        (states, counts) = self._sorted_counts(node, self.counts[node.name])
+        node.compile(states, self._normalize(counts))
+        node._source = self
+        instrument.count("cpt_builds")
+
+    def _sorted_counts(self, node, counts):
+        """return a node's sorted states, and a family count table padded to
+        every state seen and re-coded in the order of the sorted states.
         """
+        family = node.parents_names + [node.name]
+        sorted_states = [encoding.sort_states(self._states[name]) for name in family]
+        counts = tables.pad(counts, [len(ls) for (ls, _) in sorted_states])
+        counts = tables.permute(counts, [order for (_, order) in sorted_states])
+        return sorted_states[-1][0], counts
 
+    def _materialize(self):
+        """count every family that is still waiting to be fit lazily.
+        """
         for node in self.ls_nodes:
-            node.cpt = self._calculate_cpt(node)
+            if node.name not in self.counts or (node._source is self and node._stale):
+                self._fit_node(node)
+
+    def _column(self, name):
+        """return the codes of a column of the lazily fit observations, 
+        encoding it on first use.
+        """
+        codes = self._dataset.codes(name)
+        self._states[name] = self._dataset.states[name]
+        return codes
+
+    def _fit_states(self, node):
+        """set a stale node's states from its column, without fitting its cpt.
+        """
+        self._column(node.name)
+        (node._states, _) = encoding.sort_states(self._states[node.name])
+        node._state_codes = dict((s, i) for (i, s) in enumerate(node._states))
+
+    @instrument.timed("fit.family")
+    def _fit_node(self, node):
+        """count a stale node's family in the observations and compile its 
+        cpt. called on first access of the node's table.
+        """
+        if self._dataset is None:
+            raise ValueError("{}'s counts are not available: the model was loaded "
+                             "without them, or the node's parents changed since the "
+                             "model was fit from a stream; fit the model again."
+                             .format(node.name))
+        family = node.parents_names + [node.name]
+        codes = [self._column(name) for name in family]
+        self.counts[node.name] = tables.count(codes, [len(self._states[name]) for name in family], 
+                                              self.max_dense_size)
+        self._compile_family(node)
+
+    def _normalize(self, counts):
+        """return counts, plus the pseudo-count, normalized over the last axis.
+        rows without counts become uniform.
+        """
+        if isinstance(counts, tables.SparseTable):
+            return counts.normalize(self.pseudo_count)
+        counts = counts + self.pseudo_count
+        totals = counts.sum(axis=-1, keepdims=True)
+        uniform = np.full(counts.shape, 1. / counts.shape[-1])
+        return np.where(totals > 0, counts / np.where(totals > 0, totals, 1), uniform)
         
     def _generate_dict_nodes(self):
         """return a dictionary, where key is node name and value is the 
@@ -55,17 +342,120 @@ class BN(object):
     
     def _generate_dict_children(self):
         """return a dictionary, where key is name of node and value is a
-        list of its children."""
-        d = {}
-        for parent in self.ls_nodes:
-            children = []
-            
-            for child in self.ls_nodes:
-                if parent in child.ls_parents:
-                    children.append(child.name)
-            d[parent.name] = children
+        list of its children, in the order of ls_nodes."""
+        d = dict((node.name, []) for node in self.ls_nodes)
+        for child in self.ls_nodes:
+            for parent in child.parents_names:
+                if parent not in d:
+                    raise ValueError("{}'s parent {} is not in the network.".format(
+                        child.name, parent))
+                d[parent].append(child.name)
         return d
-    
+
+    def _build_index(self):
+        """index the graph once: children, a topological order, and empty 
+        caches for ancestor sets, execution plans and markov blankets.
+
+        the index is rebuilt whenever one of the network's nodes has its 
+        parents reassigned (see Node.ls_parents). a graph with a cycle raises
+        a ValueError.
+        """
+        self._graph_changed = True  # until the index is complete
+        self._dict_children = self._generate_dict_children()
+        self._topological_order = self._kahn()
+        self._ancestors = {}
+        self._plans = {}
+        self._blankets = {}
+        self._graph_changed = False
+
+    def _register(self):
+        """register the network with its nodes, which notify it of changes.
+        """
+        for node in self.ls_nodes:
+            node._networks.add(self)
+
+    def _changed(self, graph):
+        """called by a node when its table, and its parents if graph, change.
+        """
+        self._tables_changed = True
+        if graph:
+            self._graph_changed = True
+
+    def _refresh(self):
+        """rebuild the index if the graph changed since it was built.
+        """
+        if self._graph_changed:
+            self._build_index()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._register()
+
+    def invalidate(self):
+        """rebuild the graph index. parent lists that are mutated in place 
+        (eg node.ls_parents.append(x)) are not detected automatically, so call
+        invalidate() afterwards.
+        """
+        self._build_index()
+
+    @property
+    def dict_children(self):
+        self._refresh()
+        return self._dict_children
+
+    @property
+    def topological_order(self):
+        self._refresh()
+        return self._topological_order
+
+    def _kahn(self):
+        """return every node in topological order, using kahn's algorithm. 
+        ties are broken by the order of ls_nodes.
+        """
+        indegree = dict((node.name, len(node.ls_parents)) for node in self.ls_nodes)
+        ready = deque(node.name for node in self.ls_nodes if indegree[node.name] == 0)
+
+        order = []
+        while ready:
+            name = ready.popleft()
+            order.append(self.dict_nodes[name])
+            for child in self._dict_children[name]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    ready.append(child)
+
+        if len(order) < len(self.ls_nodes):
+            cycle = [name for (name, d) in indegree.items() if d > 0]
+            raise ValueError("graph has a cycle through: {}".format(cycle))
+        return order
+
+    def ancestors(self, node):
+        """return the set of names of a node's ancestors, including itself. 
+        ancestor sets are cached.
+
+        node may also be a list of nodes, whose ancestors are found together 
+        in one traversal of the graph.
+        """
+        self._refresh()
+        if isinstance(node, (list, tuple, set, frozenset)):
+            return frozenset(self._find_ancestors([self._name(n) for n in node]))
+        name = self._name(node)
+        if name not in self._ancestors:
+            self._ancestors[name] = frozenset(self._find_ancestors([name]))
+        return self._ancestors[name]
+
+    def _find_ancestors(self, names):
+        """return the set of names, and of all their ancestors.
+        """
+        found = set(names)
+        frontier = list(found)
+        while frontier:
+            for parent in self.dict_nodes[frontier.pop()].ls_parents:
+                if parent.name not in found:
+                    found.add(parent.name)
+                    frontier.append(parent.name)
+        return found
+
     def show(self, **kwargs):
         import networkx as nx
         from networkx.drawing.nx_agraph import write_dot, graphviz_layout
@@ -77,26 +467,6 @@ class BN(object):
         plt.axis('off')
         plt.show()
         
-    def _calculate_cpt(self, node):
-        """compute conditional probability table for the specified node.
-        """
-
-        # find its parents
-        parent = node.ls_parents
-        
-        # subset its corresponding marginals
-        ps = [self.observations[x.name] for x in parent]
-        cs = self.observations[node.name]
-        
-        # finally, crosstab
-        # # https://stackoverflow.com/questions/53510319/python-pandas-merging-with-more-than-one-level-overlap-on-a-multi-index-is-not
-        cpt = pd.crosstab(ps, cs, normalize = 'index').reset_index()
-        
-        # if node is a marginal, it wont have parents, so drop unnecessary columns
-        if node.is_marginal:
-            cpt.drop("index", axis=1, inplace=True)
-        return cpt
-
     def scheduler(self, node):
         """given a node, return its topological graph, which refers to the 
         precise sequence of parent nodes to be executed. this allows proper
@@ -104,120 +474,638 @@ class BN(object):
 
         for example, if A->B->C is the causal model, then model.sample(C)
         returns [A, B, C].
-        """
-        lifo = deque([node])  # final list for topological sort
-        fifo = deque([node])  # temporary list, for breadth first search.
-
-        while len(fifo) > 0:
-            
-            # grab a node from fifo for examination
-            curr = fifo.pop()
-            # print('evaluating', curr.name)
 
-            # fetch its parents
-            ls_parents = curr.parents_nodes
+        the plan is a topological sort of the node's ancestors. among nodes 
+        that are ready to run, those furthest from the node (in breadth first
+        order over parents) run first. plans are cached per node.
+        """
+        self._refresh()
+        if node.name in self._plans:
+            return list(self._plans[node.name])
 
-            # evaluate each parent node
-            for p in ls_parents:
+        # breadth first search over parents, recording discovery order
+        discovered = [node]
+        seen = set([node.name])
+        for curr in discovered:
+            for p in curr.parents_nodes:
+                if p.name not in seen:
+                    seen.add(p.name)
+                    discovered.append(p)
+        priority = dict((n.name, -i) for (i, n) in enumerate(discovered))
 
-                # ignore if parent has already been added to topological graph
-                if p in lifo:
-                    pass
-                
-                # otherwise, add parent to topological graph
-                else:
-                    lifo.append(p)
-                    fifo.appendleft(p)
+        # kahn's algorithm over the ancestors, ties broken by priority
+        indegree = dict((n.name, len(n.ls_parents)) for n in discovered)
+        ready = [(priority[n.name], n.name) for n in discovered if indegree[n.name] == 0]
+        heapq.heapify(ready)
 
-            # print("fifo: ", list(map(lambda p: p.name, fifo)))
-            # print("lifo", list(map(lambda p: p.name, lifo)))
-            # print("-"*40)
+        plan = []
+        while ready:
+            (_, name) = heapq.heappop(ready)
+            plan.append(self.dict_nodes[name])
+            for child in self._dict_children[name]:
+                if child in indegree:
+                    indegree[child] -= 1
+                    if indegree[child] == 0:
+                        heapq.heappush(ready, (priority[child], child))
 
-        lifo.reverse()  # reverse mutates list in place
-        return lifo
+        self._plans[node.name] = plan
+        return list(plan)
     
-    def _execute(self, node):
-        """sample from a node and its ancestors.
-
-        first, _execute() fetchs an ordered list of operations from the 
-        scheduler. then, _execute() samples from each node and records results. 
-        finally, it returns a dict of results, where each k = node name and v = 
-        state.
+    def _samples_dataset(self, names, codes):
+        """return an array of state codes, with one column per name, as an 
+        encoding.Dataset over each node's states.
+        """
+        return encoding.Dataset.from_codes(
+            dict((var, codes[:, i]) for (i, var) in enumerate(names)),
+            dict((var, self.dict_nodes[var].states) for var in names))
 
-        _execute() is important when order of execution matters.
+    def _samples_frame(self, names, codes):
+        """map an array of state codes, with one column per name, back to each 
+        node's states (eg booleans), as a dataframe with one typed column per 
+        random variable.
         """
-        
-        # track state of each random variable (to be used for querying cpt)
-        temp_dict = {}
-        
-        # ask scheduler for order of operations (nodes sampled in order)
-        execution_order = self.scheduler(node)
-        
-        # sample each node according to order
-        for curr in execution_order:
-            
-            # if node is a marginal, we dont need parents' states
-            if curr.is_marginal:
-                res = self._sample(curr)
-            
-            # otherwise, we query its cpt using its parents' states
-            else:
-                parent_states = []  # query
-                for p in curr.parents_names:
-                    parent_states.append(temp_dict[p])
-
-                # sample node (conditioned on its parents' states)
-                res = self._sample(curr, parent_states)
-                
-            # finally, update temp_dict with results
-            temp_dict[curr.name] = res
-                
-        # clean up strings before returning
-        for k in temp_dict.keys():
-            temp_dict[k] = temp_dict[k].split("==")[1]
-
-        return temp_dict
-    
-    def _sample(self, node, parent_states=None):
-        """a wrapper function around Node's sample() method
+        return self._samples_dataset(names, codes).to_frame()
 
-        _sample() calls a Node's sample() method, and subsequently wraps the
-        result (the state of the random variable) with the Node's name. 
+    def _execution_order(self, targets):
+        """return the execution order for sampling several nodes together, eg
+        a node and evidence nodes that may not be its ancestors.
+        """
+        required = self.ancestors(list(targets))
+        return [node for node in self.topological_order if node.name in required]
 
-        for example, calling _sample("cloud") returns "cloudy==True".
-        """        
-        res = node.sample(parent_states)[0]
-        return node.name + "==" + str(res)
-    
-    def generate_samples(self, node, n_samples=1):
+    @instrument.timed("generate_samples")
+    def generate_samples(self, node, n_samples=1, evidence=None, 
+                         method="likelihood_weighting", n_jobs=1, random_state=None,
+                         as_dataset=False, max_draws=10**8):
         """generate a batch of joint observations.
         
         generate_samples() generates samples for the specified node and its 
         corresponding ancestors. 
 
-        for each trial, it calls _execute(), which returns a dict, where k = 
-        node name and v = state of random variable. these results are tallied
-        in a single dataframe and returned to the user.
+        rather than sampling one trial at a time, trials are drawn together in
+        shards, one node at a time (see sampling.sample()), and returned as a 
+        dataframe with one typed column per random variable. shards run across
+        n_jobs worker processes (every cpu if n_jobs is None), and each shard 
+        draws from its own stream spawned from random_state, so a given 
+        random_state gives identical samples whatever n_jobs is.
+
+        if evidence is given (a dict, where k = node (or node name) and v = 
+        observed state), evidence nodes are sampled too, and a tuple of the 
+        dataframe and an array of per-sample weights is returned. with 
+        method="likelihood_weighting", evidence nodes are clamped and each 
+        sample is weighted by the likelihood of the evidence. with 
+        method="rejection", samples that disagree with the evidence are 
+        discarded until n_samples remain, and every weight is 1; a ValueError
+        is raised if that takes more than about max_draws samples.
+
+        if as_dataset, samples are returned as an encoding.Dataset of the 
+        drawn state codes instead, which fit() and structure learning use 
+        without decoding them.
         """
+        if method not in ("likelihood_weighting", "rejection"):
+            raise ValueError("method must be 'likelihood_weighting' or 'rejection'.")
 
-        # track sample's states with a dictionary across all trials
-        df = {}
+        coded = self._encode_evidence(evidence)
+        if evidence is None:
+            execution_order = self.scheduler(node)
+        else:
+            execution_order = self._execution_order(
+                [node] + [self.dict_nodes[name] for name in coded])
 
-        # ask scheduler for list of nodes that will be sampled
-        random_vars = list(map(lambda x: x.name, self.scheduler(node)))
-        for var in random_vars:
-            df[var] = []
+        plan = sampling.compile_plan(execution_order)
+        position = dict((name, i) for (i, name) in enumerate(plan["names"]))
+        coded = dict((position[k], v) for (k, v) in coded.items())
 
-        # sample from nodes and accordingly update tracker
-        for _ in tqdm(range(n_samples)):
-            sample = self._execute(node)
-            for (var, state) in sample.items():
-                df[var].append(state)
-        
-        # convert dictionary into a dataframe
-        df = pd.DataFrame(df)
+        codes, weights = sampling.sample_shards(plan, n_samples, coded, method, 
+                                                n_jobs, random_state, max_draws=max_draws)
+        instrument.count("samples_drawn", n_samples)
+        if as_dataset:
+            samples = self._samples_dataset(plan["names"], codes)
+        else:
+            samples = self._samples_frame(plan["names"], codes)
+        if evidence is None:
+            return samples
+        return samples, weights
+
+    def iter_samples(self, node, n_samples, batch_size=100000, random_state=None):
+        """generate joint observations of a node and its ancestors as a stream
+        of dataframes, each with at most batch_size rows and one typed column 
+        per random variable.
+
+        only one batch is held in memory at a time, so the stream can be 
+        written out with sinks.write_samples() in constant memory. batch i 
+        draws from the i-th stream spawned from random_state.
+        """
+        plan = sampling.compile_plan(self.scheduler(node))
+        seeds = np.random.SeedSequence(random_state)
+
+        for start in range(0, n_samples, batch_size):
+            with instrument.stage("iter_samples.batch"):
+                rng = np.random.default_rng(seeds.spawn(1)[0])
+                size = min(batch_size, n_samples - start)
+                codes, _ = sampling.sample(plan, size, rng)
+                batch = self._samples_frame(plan["names"], codes)
+            instrument.count("samples_drawn", size)
+            yield batch
+
+    def markov_blanket(self, node):
+        """return the names of a node's markov blanket: its parents, its 
+        children and its children's other parents. blankets are cached.
+        """
+        self._refresh()
+        name = self._name(node)
+        if name not in self._blankets:
+            blanket = list(self.dict_nodes[name].parents_names)
+            for child in self.dict_children[name]:
+                for n in [child] + self.dict_nodes[child].parents_names:
+                    if n != name and n not in blanket:
+                        blanket.append(n)
+            self._blankets[name] = blanket
+        return self._blankets[name]
+
+    @instrument.timed("gibbs")
+    def gibbs(self, evidence=None, n_samples=1000, n_chains=4, burn_in=100, thin=1,
+              n_jobs=None, random_state=None):
+        """approximate the posterior over every node with gibbs sampling.
+
+        each of the n_chains chains runs in its own worker process (n_jobs 
+        workers, every cpu by default) with an independent random stream 
+        spawned from random_state. every node that is not evidence is 
+        resampled in turn from its distribution given its markov blanket. a 
+        chain discards burn_in sweeps and then keeps every thin-th sweep until
+        it has n_samples.
+
+        returns a tuple of (1) a dataframe with the n_chains * n_samples kept 
+        draws, chain by chain, and (2) a dict, where k = node name and v = a 
+        dict of its split r-hat ('rhat') and effective sample size ('ess').
+        """
+        from . import mcmc
+
+        evidence = self._encode_evidence(evidence)
+        model = mcmc.compile_model(self)
+        names = model["names"]
+        coded = dict((names.index(k), v) for (k, v) in evidence.items())
+
+        chains = mcmc.gibbs(model, coded, n_samples, n_chains, burn_in, thin, 
+                            n_jobs, random_state)
+        draws = chains.reshape(-1, len(names))
+        instrument.count("samples_drawn", len(draws))
+        samples = self._samples_frame(names, draws)
+        return samples, mcmc.diagnostics(chains, model["cards"], names, coded)
+
+    @instrument.timed("query")
+    def query(self, targets, evidence=None, heuristic='min_fill'):
+        """compute the exact posterior P(targets | evidence) by variable 
+        elimination.
+
+        targets is a node (or node name), or a list of them. evidence is a 
+        dict, where k = node (or node name) and v = observed state. for 
+        example, model.query(wet, {cloudy: True}) returns P(wet | cloudy=True).
+
+        before eliminating, nodes that are barren or d-separated from the 
+        targets are pruned, and the remaining variables are eliminated in a 
+        greedy 'min_fill' or 'min_weight' order. returns a dataframe with one 
+        column per target and a 'prob' column, with one row per joint state.
+        """
+        if not isinstance(targets, (list, tuple)):
+            targets = [targets]
+        targets = [self._name(t) for t in targets]
+        evidence = self._encode_evidence(evidence)
         
-        # recast each row value from str ("True") to boolean (True)
-        for col in df.columns:
-            df[col] = df[col] == "True"
-        return df
\ No newline at end of file
+        for t in targets:
+            if t in evidence:
+                raise ValueError("a target cannot also be evidence.")
+
+        return self._posterior_frame(targets, self._infer(targets, evidence, heuristic))
+
+    def _infer(self, targets, evidence, heuristic='min_fill'):
+        """return P(targets | evidence) as a table, given target names and 
+        evidence as a dict, where k = node name and v = state code.
+        """
+        # collect the factors that can affect the answer
+        requisite = inference.requisite_nodes(self, targets, evidence)
+        factors = [inference.node_factor(self.dict_nodes[n], evidence) for n in requisite]
+
+        cards = dict((n, len(self.dict_nodes[n].states)) for n in requisite)
+        eliminate = set(v for (scope, _) in factors for v in scope) - set(targets)
+        order = inference.elimination_order([scope for (scope, _) in factors], 
+                                            cards, eliminate, heuristic)
+        return inference.variable_elimination(factors, targets, order)
+
+    @instrument.timed("score_samples")
+    def score_samples(self, observations, chunksize=100000):
+        """return the log-probability of each row of observations under the 
+        fitted network, as an array.
+
+        observations may be a dataframe, a path to a csv (read chunksize rows
+        at a time) or an iterable of dataframe chunks. a row's log-probability
+        is the sum, over nodes, of the log of its cpt entry for the row's 
+        family, looked up for every row at once. nodes whose column is 
+        missing, or whose value is NaN, are marginalized out (see 
+        _log_marginal()). a state the node has never seen has probability 0.
+        """
+        if isinstance(observations, pd.DataFrame):
+            return self._score_chunk(observations)
+        return np.concatenate([self._score_chunk(chunk) 
+                               for chunk in self._chunks(observations, chunksize)] or [np.zeros(0)])
+
+    def log_likelihood(self, observations, chunksize=100000):
+        """return the total log-probability of observations (see 
+        score_samples()), one chunk at a time.
+        """
+        if isinstance(observations, pd.DataFrame):
+            return float(self._score_chunk(observations).sum())
+        return float(sum(self._score_chunk(chunk).sum() 
+                         for chunk in self._chunks(observations, chunksize)))
+
+    def _score_chunk(self, chunk):
+        """return the log-probability of every row of a dataframe.
+        """
+        n = len(chunk)
+        names = [node.name for node in self.ls_nodes]
+        (codes, observed, impossible) = self._encode_rows(chunk)
+        position = dict((name, i) for (i, name) in enumerate(names))
+
+        # nodes whose whole family is observed are looked up directly. only 
+        # the family's columns are gathered, and only if some rows are masked
+        scores = np.zeros(n)
+        complete = observed.all() and not impossible.any()
+        with np.errstate(divide='ignore'):
+            for node in self.ls_nodes:
+                family = [position[name] for name in node.parents_names + [node.name]]
+                if complete:
+                    rows = slice(None)
+                    index = tuple(codes[:, i] for i in family)
+                else:
+                    rows = observed[:, family].all(axis=1) & ~impossible
+                    index = tuple(codes[rows, i] for i in family)
+
+                # a dense cpt is logged once, rather than once per row
+                if isinstance(node.table, tables.SparseTable):
+                    scores[rows] += np.log(node.table[index])
+                else:
+                    scores[rows] += np.log(node.table)[index]
+
+            # the rest of each missing-value pattern is summed out together.
+            # patterns are packed into bytes, so rows are grouped with a 1-d 
+            # np.unique
+            incomplete = np.flatnonzero(~observed.all(axis=1) & ~impossible)
+            packed = np.packbits(observed[incomplete], axis=1)
+            packed = np.ascontiguousarray(packed).view(np.dtype((np.void, packed.shape[1])))
+            (_, first, pattern) = np.unique(packed.ravel(), return_index=True, return_inverse=True)
+            for (p, row) in enumerate(first):
+                rows = incomplete[pattern == p]
+                mask = observed[incomplete[row]]
+                present = [name for (name, m) in zip(names, mask) if m]
+                scores[rows] += self._log_marginal(present, codes[rows], position)
+        scores[impossible] = -np.inf
+        return scores
+
+    def _encode_rows(self, chunk):
+        """return the state codes of a dataframe's rows, with one column per 
+        node in ls_nodes (-1 if missing or unseen), a mask of the observed 
+        values, and a mask of the rows with a state a node has never seen.
+        """
+        n = len(chunk)
+        # column-major, since columns are filled and read one node at a time
+        codes = np.full((n, len(self.ls_nodes)), -1, dtype=np.intp, order='F')
+        observed = np.zeros((n, len(self.ls_nodes)), dtype=bool, order='F')
+        impossible = np.zeros(n, dtype=bool)
+        for (i, node) in enumerate(self.ls_nodes):
+            if node.name not in chunk.columns:
+                continue
+            values = chunk[node.name].values
+            codes[:, i] = pd.Index(node.states).get_indexer(values)
+
+            # only values without a code can be missing
+            uncoded = np.flatnonzero(codes[:, i] < 0)
+            observed[:, i] = True
+            observed[uncoded, i] = ~pd.isna(values[uncoded])
+            impossible[uncoded] |= observed[uncoded, i]
+        return codes, observed, impossible
+
+    def _log_marginal(self, present, codes, position):
+        """return, for each row of codes, the log of the product of the cpts 
+        that involve a missing variable, with the missing variables summed out.
+
+        only ancestors of the present variables matter; other missing 
+        variables are barren and sum to 1. when the present variables those 
+        cpts mention have few joint states, the sum is computed once as a 
+        table over them and looked up per row. otherwise it is computed once
+        per distinct combination of their values in the rows.
+        """
+        present = set(present)
+        relevant = self.ancestors(present)
+        nodes = [self.dict_nodes[name] for name in relevant
+                 if not set(self.dict_nodes[name].parents_names + [name]) <= present]
+        if not nodes:
+            return np.zeros(len(codes))
+
+        scopes = [node.parents_names + [node.name] for node in nodes]
+        evidence = sorted(set(v for scope in scopes for v in scope) & present, key=position.get)
+        cards = dict((name, len(self.dict_nodes[name].states)) for name in relevant)
+        missing = set(v for scope in scopes for v in scope) - present
+        order = inference.elimination_order(scopes, cards, missing)
+        columns = [codes[:, position[name]] for name in evidence]
+
+        # sparse cpts are only expanded once reduced by a row's evidence
+        sparse = any(isinstance(node.table, tables.SparseTable) for node in nodes)
+        if not sparse and np.prod([cards[name] for name in evidence]) <= tables.MAX_DENSE_SIZE:
+            factors = [inference.node_factor(node) for node in nodes]
+            (scope, table) = inference.multiply(inference.eliminate(factors, order), evidence)
+            table = np.transpose(table, [scope.index(v) for v in evidence])
+            return np.log(table[tuple(columns)])
+
+        combined, n_codes = encoding.combine(columns, [cards[name] for name in evidence])
+        first = np.unique(combined, return_index=True)[1]
+        logp = np.empty(n_codes)
+        for (code, row) in enumerate(first):
+            observed = dict((name, codes[row, position[name]]) for name in evidence)
+            reduced = [inference.node_factor(node, observed) for node in nodes]
+            (_, table) = inference.multiply(inference.eliminate(reduced, order), [])
+            logp[code] = np.log(table)
+        return logp[combined]
+
+    @instrument.timed("predict_proba")
+    def predict_proba(self, observations, targets):
+        """return P(target | each row's observed values) for every row of a 
+        dataframe. targets is a node (or node name), or a list of them.
+
+        a row's evidence is its non-missing values of the network's other 
+        nodes; a target's own column is never evidence. rows are grouped by 
+        their evidence, so each distinct evidence is inferred once (see 
+        query()) and broadcast back to its rows. posteriors are also kept in 
+        an lru cache across calls, which is cleared when the network is refit
+        or its graph changes.
+
+        returns a dataframe, indexed like observations, with one column per 
+        state of the target, or a dict of them (k = target name) for a list of
+        targets. rows whose evidence has zero probability, or a state a node 
+        has never seen, are NaN.
+        """
+        single = not isinstance(targets, (list, tuple))
+        targets = [self._name(t) for t in ([targets] if single else targets)]
+        (codes, observed, impossible) = self._encode_rows(observations)
+        names = [node.name for node in self.ls_nodes]
+
+        if self._tables_changed:
+            self._posteriors.clear()
+
+        answers = {}
+        for target in targets:
+            # missing values and the target's own column are coded -1
+            keys = np.where(observed, codes, -1).astype(np.min_scalar_type(-max(
+                len(node.states) for node in self.ls_nodes)), order='C')
+            keys[:, names.index(target)] = -1
+            packed = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1])))
+            (_, first, group) = np.unique(packed.ravel(), return_index=True, return_inverse=True)
+
+            card = len(self.dict_nodes[target].states)
+            posteriors = np.empty((len(first), card))
+            for (g, row) in enumerate(first):
+                evidence = tuple((names[i], keys[row, i]) for i in np.flatnonzero(keys[row] >= 0))
+                posteriors[g] = self._cached_posterior(target, evidence)
+
+            probs = posteriors[group.ravel()]
+            probs[impossible] = np.nan
+            answers[target] = pd.DataFrame(probs, index=observations.index, 
+                                           columns=self.dict_nodes[target].states)
+
+        self._tables_changed = False  # tables fit lazily above are cached
+        return answers[targets[0]] if single else answers
+
+    def predict(self, observations, targets):
+        """return the most probable state of each target for every row of a 
+        dataframe, given the row's observed values (see predict_proba()), as 
+        a dataframe indexed like observations with one column per target. 
+
+        to impute missing values, fill them from the prediction, eg 
+        observations.fillna(model.predict(observations, targets)).
+        """
+        if not isinstance(targets, (list, tuple)):
+            targets = [targets]
+        answers = self.predict_proba(observations, list(targets))
+
+        predictions = pd.DataFrame(index=observations.index)
+        for (target, probs) in answers.items():
+            states = np.array(self.dict_nodes[target].states, dtype=object)
+            values = states[np.nan_to_num(probs.values, nan=-1.).argmax(axis=1)]
+            values[probs.isna().any(axis=1).values] = np.nan
+            predictions[target] = values
+        return predictions
+
+    def _cached_posterior(self, target, evidence):
+        """return P(target | evidence) as an array, where evidence is a tuple
+        of (node name, state code) pairs, from the lru cache if possible.
+        """
+        key = (target, evidence)
+        if key in self._posteriors:
+            self._posteriors.move_to_end(key)
+            instrument.count("posteriors_cached")
+            return self._posteriors[key]
+
+        try:
+            posterior = self._infer([target], dict(evidence))
+        except ValueError:  # evidence has zero probability
+            posterior = np.full(len(self.dict_nodes[target].states), np.nan)
+        instrument.count("posteriors")
+
+        self._posteriors[key] = posterior
+        while len(self._posteriors) > self.posterior_cache_size:
+            self._posteriors.popitem(last=False)
+        return posterior
+
+    def compile_junction_tree(self, heuristic='min_fill'):
+        """compile the fitted network into a JunctionTree, which answers many
+        marginal queries with different evidence without re-eliminating.
+
+        for example:
+
+        jt = model.compile_junction_tree()
+        jt.set_evidence({cloudy: True})
+        jt.marginals()  # P(node | cloudy=True) for every node
+        """
+        from .JunctionTree import JunctionTree
+        return JunctionTree(self, heuristic)
+
+    def save(self, path):
+        """save the fitted network to a directory at path: header.json holds 
+        the graph, a topological order and every node's states, and 
+        tables.npy holds every compiled cpt, one after another, as a single 
+        flat float64 array. the keys of sparse cpts are saved in keys.npy.
+
+        the family counts that partial_fit() updates (and, with a window, the
+        counts of each batch in the window) are saved the same way in 
+        counts.npy and count_keys.npy, so a loaded network can keep learning.
+        states must be json values (bool, int, float or str).
+        """
+        nodes = []
+        cpts = []
+        for node in self.ls_nodes:
+            if node.table is None:
+                raise ValueError('need to fit model with observations.')
+            states = [s.item() if isinstance(s, np.generic) else s for s in node.states]
+            if not all(isinstance(s, (bool, int, float, str)) for s in states):
+                raise ValueError("{} has states that cannot be saved.".format(node.name))
+            nodes.append({"name": node.name, "parents": node.parents_names, "states": states})
+            cpts.append(node.table)  # fits the node, if it is fit lazily
+
+        # counts are saved in the order of the sorted states, like the cpts
+        counts = []
+        has_counts = all(node.name in self.counts and self._states[node.name] 
+                         for node in self.ls_nodes)
+        if has_counts:
+            for node in self.ls_nodes:
+                family = [self.counts[node.name]] + [batch[node.name] for batch in self._batches]
+                counts.extend(self._sorted_counts(node, c)[1] for c in family)
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for (entry, layout) in zip(nodes, _write_tables(path, "tables.npy", "keys.npy", cpts)):
+            entry.update(layout)
+        if has_counts:
+            layouts = _write_tables(path, "counts.npy", "count_keys.npy", counts)
+            n = 1 + len(self._batches)
+            for (i, entry) in enumerate(nodes):
+                entry["counts"] = layouts[i * n:(i + 1) * n]
+
+        header = {"nodes": nodes, 
+                  "topological_order": [node.name for node in self.topological_order],
+                  "pseudo_count": self.pseudo_count, "decay": self.decay, 
+                  "window": self.window}
+        with open(os.path.join(path, "header.json"), "w") as f:
+            json.dump(header, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """load a network saved with save(). 
+
+        with mmap=True, the tables are memory-mapped read-only rather than 
+        read, so loading is nearly instant and processes that load the same 
+        model share one copy of it in the page cache. every node's table is a
+        view into the mapped array.
+
+        saved counts are loaded too (copied on the first partial_fit()). a 
+        network saved without counts, eg with cpts given by specify_cpt(),
+        has to be refit with fit() before partial_fit().
+        """
+        with open(os.path.join(path, "header.json")) as f:
+            header = json.load(f)
+        mode = "r" if mmap else None
+        cpts = _TableReader(path, "tables.npy", "keys.npy", mode)
+
+        # parents are created before their children
+        entries = dict((entry["name"], entry) for entry in header["nodes"])
+        dict_nodes = {}
+        for name in header["topological_order"]:
+            entry = entries[name]
+            node = Node(name, [dict_nodes[p] for p in entry["parents"]])
+            node.compile(entry["states"], cpts.read(entry))
+            dict_nodes[name] = node
+
+        bn = cls([dict_nodes[entry["name"]] for entry in header["nodes"]],
+                 header["pseudo_count"], header["decay"], header["window"])
+        if not all("counts" in entry for entry in header["nodes"]):
+            bn.counts = {}  # partial_fit() needs the counts
+            return bn
+
+        counts = _TableReader(path, "counts.npy", "count_keys.npy", mode)
+        n_batches = len(header["nodes"][0]["counts"]) - 1
+        bn._batches.extend({} for _ in range(n_batches))
+        for entry in header["nodes"]:
+            name = entry["name"]
+            bn._states[name] = dict((s, i) for (i, s) in enumerate(entry["states"]))
+            family = [counts.read(layout) for layout in entry["counts"]]
+            bn.counts[name] = family[0]
+            for (batch, c) in zip(bn._batches, family[1:]):
+                batch[name] = c
+        return bn
+
+    def _name(self, node):
+        """return a node's name, given either the node or its name.
+        """
+        name = getattr(node, "name", node)
+        if name not in self.dict_nodes:
+            raise ValueError("{} is not a node in the network.".format(name))
+        return name
+
+    def _encode_evidence(self, evidence):
+        """return evidence as a dict, where k = node name and v = state code.
+        """
+        encoded = {}
+        for (node, state) in (evidence or {}).items():
+            node = self.dict_nodes[self._name(node)]
+            if node.state_codes is None:
+                raise ValueError('need to fit model with observations.')
+            if state not in node.state_codes:
+                raise ValueError("{} is not a state of {}.".format(state, node.name))
+            encoded[node.name] = node.state_codes[state]
+        return encoded
+
+    def _posterior_frame(self, targets, table):
+        """flatten a joint table over targets into a dataframe with one column
+        per target and a 'prob' column.
+        """
+        states = [self.dict_nodes[t].states for t in targets]
+        rows = list(itertools.product(*states))
+        df = pd.DataFrame(rows, columns=targets)
+        df["prob"] = table.ravel()
+        return df
+
+def _write_tables(path, cells_name, keys_name, ls_tables):
+    """write dense and sparse tables one after another, as a single flat 
+    float64 array in cells_name, with the keys of sparse tables in keys_name. 
+    a sparse table is written as its rows, then its default row. returns the
+    layout of each table, a dict of its shape, offset and, if sparse, the 
+    offset and number of its keys.
+    """
+    layouts = []
+    flat = []
+    keys = []
+    offset = 0
+    key_offset = 0
+    for table in ls_tables:
+        layout = {"shape": list(table.shape), "offset": offset}
+        if isinstance(table, tables.SparseTable):
+            layout["keys"] = [key_offset, len(table.keys)]
+            flat.append(np.concatenate([table.rows.ravel(), table.default]))
+            keys.append(table.keys)
+            key_offset += len(table.keys)
+        else:
+            flat.append(np.asarray(table, dtype=np.float64).ravel())
+        layouts.append(layout)
+        offset += flat[-1].size
+
+    cells = np.lib.format.open_memmap(os.path.join(path, cells_name), mode="w+", 
+                                      dtype=np.float64, shape=(offset,))
+    for (layout, values) in zip(layouts, flat):
+        cells[layout["offset"]:layout["offset"] + values.size] = values
+    cells.flush()
+    del cells
+    np.save(os.path.join(path, keys_name), 
+            np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64))
+    return layouts
+
+class _TableReader(object):
+    """reads tables written by _write_tables(), as views into the (memory 
+    mapped, if mode is 'r') flat array.
+    """
+
+    def __init__(self, path, cells_name, keys_name, mode):
+        self.cells = np.load(os.path.join(path, cells_name), mmap_mode=mode)
+        self.keys_path = os.path.join(path, keys_name)
+        self.mode = mode
+        self.keys = None
+
+    def read(self, layout):
+        shape = layout["shape"]
+        offset = layout["offset"]
+        if "keys" not in layout:
+            size = int(np.prod(shape))
+            return self.cells[offset:offset + size].reshape(shape)
+        if self.keys is None:
+            self.keys = np.load(self.keys_path, mmap_mode=self.mode)
+        (start, n_keys) = layout["keys"]
+        rows = self.cells[offset:offset + (n_keys + 1) * shape[-1]]
+        return tables.SparseTable(shape, self.keys[start:start + n_keys], 
+                                  rows[:-shape[-1]], rows[-shape[-1]:])
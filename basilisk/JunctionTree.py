@@ -0,0 +1,307 @@
+"""
+JunctionTree compiles a fitted BN into a calibrated clique tree.
+"""
+
+import numpy as np
+from . import inference
+from .tables import SparseTable
+from . import instrument
+
+class JunctionTree(object):
+    """
+    a junction tree answers repeated marginal queries against one fitted BN.
+    messages between cliques are cached, and when evidence changes only the
+    messages that depend on the changed evidence are recomputed.
+
+    parameters
+    ----------
+    bn : BN
+        a fitted bayesian network. its cpts are read once, when the tree is
+        compiled, so refitting the BN requires compiling a new tree.
+
+    heuristic : str
+        'min_fill' or 'min_weight', used to triangulate the moral graph.
+
+
+    attributes
+    ----------
+    cliques : list
+        each clique is a list of node names.
+
+    neighbors : list
+        neighbors[i] is a list of the cliques adjacent to clique i.
+
+    evidence : dictionary
+        key represents node name, value is the observed state code.
+    """
+
+    @instrument.timed("junction_tree.compile")
+    def __init__(self, bn, heuristic='min_fill'):
+        self.bn = bn
+        self.cards = dict((n.name, len(n.states)) for n in bn.ls_nodes)
+        self.cliques = self._triangulate(heuristic)
+        self.neighbors = self._build_tree()
+        self._index_tree()
+        self._assign_factors()
+
+        self.evidence = {}
+        self._potentials = {}  # clique potentials, with evidence applied
+        self._messages = {}  # k = (sender, receiver), v = factor
+
+    def _triangulate(self, heuristic):
+        """return the maximal cliques of the triangulated moral graph.
+
+        moralizing connects each node to its parents and its co-parents. the
+        graph is then triangulated by eliminating nodes in a greedy order;
+        each elimination creates a clique of the node and its neighbors.
+        """
+        scopes = [n.parents_names + [n.name] for n in self.bn.ls_nodes]
+        order = inference.elimination_order(scopes, self.cards, list(self.cards), heuristic)
+
+        graph = dict((v, set()) for v in self.cards)
+        for scope in scopes:
+            for v in scope:
+                graph[v].update(u for u in scope if u != v)
+
+        cliques = []
+        for v in order:
+            clique = graph[v] | set([v])
+
+            # only keep cliques not contained in an earlier clique
+            if not any(clique <= c for c in cliques):
+                cliques.append(clique)
+
+            adj = graph.pop(v)
+            for a in adj:
+                graph[a].update(u for u in adj if u != a)
+                graph[a].discard(v)
+
+        # order each clique's names by the network's order, for determinism
+        position = dict((n.name, i) for (i, n) in enumerate(self.bn.ls_nodes))
+        return [sorted(c, key=position.get) for c in cliques]
+
+    def _build_tree(self):
+        """connect cliques with a maximum spanning tree, weighted by separator
+        size, which satisfies the running intersection property. cliques that
+        share no variable are joined by empty separators.
+        """
+        sets = [set(c) for c in self.cliques]
+
+        # candidate edges join cliques sharing at least one variable
+        members = {}
+        for (i, c) in enumerate(self.cliques):
+            for v in c:
+                members.setdefault(v, []).append(i)
+        edges = set()
+        for ls in members.values():
+            for (a, i) in enumerate(ls):
+                for j in ls[a + 1:]:
+                    edges.add((i, j))
+        edges = sorted(edges, key=lambda e: (-len(sets[e[0]] & sets[e[1]]), e))
+        edges += [(0, j) for j in range(1, len(sets))]  # joins disconnected parts
+
+        # kruskal, with union-find over clique indices
+        root = list(range(len(sets)))
+        def find(i):
+            while root[i] != i:
+                root[i] = root[root[i]]
+                i = root[i]
+            return i
+
+        neighbors = [[] for _ in sets]
+        for (i, j) in edges:
+            (a, b) = (find(i), find(j))
+            if a != b:
+                root[a] = b
+                neighbors[i].append(j)
+                neighbors[j].append(i)
+        return neighbors
+
+    def _index_tree(self):
+        """root the tree at clique 0 and record each clique's parent, a
+        breadth-first order, and entry/exit times for ancestor checks.
+        """
+        n = len(self.cliques)
+        self.parent = [None] * n
+        self.order = [0]
+        for i in self.order:
+            for j in self.neighbors[i]:
+                if j != self.parent[i] and j != 0:
+                    self.parent[j] = i
+                    self.order.append(j)
+
+        # iterative depth first traversal for entry/exit times
+        self._tin = [0] * n
+        self._tout = [0] * n
+        clock = 0
+        stack = [(0, False)]
+        while stack:
+            (i, done) = stack.pop()
+            if done:
+                self._tout[i] = clock
+            else:
+                self._tin[i] = clock
+                stack.append((i, True))
+                stack.extend((j, False) for j in self.neighbors[i] if j != self.parent[i])
+            clock += 1
+
+        # the smallest clique containing each variable answers its marginal
+        self.home = {}
+        for (i, c) in enumerate(self.cliques):
+            for v in c:
+                if v not in self.home or len(c) < len(self.cliques[self.home[v]]):
+                    self.home[v] = i
+
+    def _is_ancestor(self, i, j):
+        """return True if clique i is clique j or one of its ancestors.
+        """
+        return self._tin[i] <= self._tin[j] and self._tout[j] <= self._tout[i]
+
+    def _assign_factors(self):
+        """multiply each node's cpt into one clique containing its family.
+        """
+        assigned = [[] for _ in self.cliques]
+        for node in self.bn.ls_nodes:
+            family = set(node.parents_names + [node.name])
+            i = min((i for (i, c) in enumerate(self.cliques) if family <= set(c)),
+                    key=lambda i: len(self.cliques[i]))
+            assigned[i].append(node)
+
+        self._base = []
+        for (c, nodes) in zip(self.cliques, assigned):
+            ones = (c, np.ones([self.cards[v] for v in c]))
+            dense = [inference.node_factor(n) for n in nodes 
+                     if not isinstance(n.table, SparseTable)]
+            (_, potential) = inference.multiply([ones] + dense, c)
+            for n in nodes:
+                if isinstance(n.table, SparseTable):
+                    _multiply_sparse(potential, c, n.parents_names + [n.name], n.table)
+            self._base.append((c, potential))
+
+    def set_evidence(self, evidence=None):
+        """replace the current evidence. evidence is a dict, where k = node (or
+        node name) and v = observed state.
+
+        only messages that depend on a clique whose evidence changed are
+        discarded; everything else stays calibrated.
+        """
+        evidence = self.bn._encode_evidence(evidence)
+        changed = set(v for v in set(evidence) | set(self.evidence)
+                      if evidence.get(v) != self.evidence.get(v))
+        self.evidence = evidence
+
+        dirty = set(self.home[v] for v in changed)
+        for d in dirty:
+            self._potentials.pop(d, None)
+
+        # message i -> j depends on every clique on i's side of the edge
+        for (i, j) in list(self._messages):
+            for d in dirty:
+                if j == self.parent[i]:
+                    stale = self._is_ancestor(i, d)
+                else:
+                    stale = not self._is_ancestor(j, d)
+                if stale:
+                    del self._messages[(i, j)]
+                    break
+
+    def _potential(self, i):
+        """return clique i's potential, with its evidence applied.
+        """
+        if i not in self._potentials:
+            (scope, table) = self._base[i]
+            for v in scope:
+                if v in self.evidence and self.home[v] == i:
+                    indicator = np.zeros(self.cards[v])
+                    indicator[self.evidence[v]] = 1.
+                    shape = [1] * len(scope)
+                    shape[scope.index(v)] = self.cards[v]
+                    table = table * indicator.reshape(shape)
+            self._potentials[i] = (scope, table)
+        return self._potentials[i]
+
+    def _message(self, i, j):
+        """return the message from clique i to clique j, computing it (and any
+        stale messages it depends on) if needed.
+        """
+        stack = [(i, j)]
+        while stack:
+            (a, b) = stack[-1]
+            if (a, b) in self._messages:
+                stack.pop()
+                continue
+
+            # messages into a, except from b, must be computed first
+            missing = [(k, a) for k in self.neighbors[a]
+                       if k != b and (k, a) not in self._messages]
+            if missing:
+                stack.extend(missing)
+                continue
+
+            factors = [self._potential(a)] + [self._messages[(k, a)]
+                                              for k in self.neighbors[a] if k != b]
+            separator = set(self.cliques[a]) & set(self.cliques[b])
+            (scope, table) = inference.multiply(factors, separator)
+
+            # rescale to avoid underflow on long paths; beliefs are normalized
+            total = table.sum()
+            self._messages[(a, b)] = (scope, table / total if total > 0 else table)
+            instrument.count("jt_messages")
+            stack.pop()
+        return self._messages[(i, j)]
+
+    @instrument.timed("junction_tree.calibrate")
+    def calibrate(self):
+        """compute every stale message, with one pass towards the root and one
+        pass away from it.
+        """
+        for j in reversed(self.order[1:]):
+            self._message(j, self.parent[j])
+        for j in self.order[1:]:
+            self._message(self.parent[j], j)
+
+    def _belief(self, i, keep):
+        """return clique i's normalized belief, summed onto keep.
+        """
+        factors = [self._potential(i)] + [self._message(k, i) for k in self.neighbors[i]]
+        (scope, table) = inference.multiply(factors, keep)
+        total = table.sum()
+        if total <= 0:
+            raise ValueError("evidence has zero probability.")
+        return (scope, table / total)
+
+    def marginal(self, node):
+        """return P(node | evidence) as a dataframe, like BN.query().
+        """
+        name = self.bn._name(node)
+        (_, table) = self._belief(self.home[name], [name])
+        return self.bn._posterior_frame([name], table)
+
+    def marginals(self):
+        """return a dict, where k = node name and v = P(node | evidence), for
+        every node. the tree is calibrated once and each clique's belief is
+        computed once for all the variables it answers.
+        """
+        self.calibrate()
+        answers = {}
+        for (i, c) in enumerate(self.cliques):
+            names = [v for v in c if self.home[v] == i]
+            if not names:
+                continue
+            (scope, table) = self._belief(i, names)
+            for v in names:
+                axes = tuple(a for (a, u) in enumerate(scope) if u != v)
+                answers[v] = self.bn._posterior_frame([v], table.sum(axis=axes))
+        return answers
+
+def _multiply_sparse(potential, clique, scope, table):
+    """multiply a clique potential, in place, by a sparse cpt over scope, 
+    without expanding the cpt: the potential is scaled by the default row, 
+    then the cells of stored configurations are set from the stored rows.
+    """
+    view = np.moveaxis(potential, [clique.index(v) for v in scope], range(len(scope)))
+    rest = (1,) * (view.ndim - len(scope))
+    configurations = np.unravel_index(table.keys, table.shape[:-1])
+    stored = view[configurations]
+    view *= table.default.reshape((1,) * (len(scope) - 1) + (-1,) + rest)
+    view[configurations] = stored * table.rows.reshape(table.rows.shape + rest)
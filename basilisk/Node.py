@@ -1,96 +1,324 @@
+import itertools
+import weakref
 import pandas as pd
 import numpy as np
+from . import instrument
+from . import tables
 
 class Node(object):
     """Nodes represents discrete random variables.
+
+    attributes
+    ----------
+    states : list
+        possible states of the random variable. a state's position in the list
+        is its integer code.
+
+    state_codes : dictionary
+        key represents a state, value is its integer code.
+
+    table : numpy array
+        compiled cpt, of shape (parent cardinalities..., cardinality). indexing
+        it with the parents' state codes returns the distribution over states.
+
+    states, state_codes and table are computed on first access when the node
+    belongs to a network fitted lazily (see BN.fit()). reassigning ls_parents
+    marks the table stale, so only this node's family is refit. a node 
+    tells the networks it belongs to when its parents or its table change, 
+    so they can drop their graph index or cached posteriors.
     """
-    
+
     def __init__(self, name, ls_parents=[]):
         self.name = name
+        self._source = None  # network that fits this node's cpt on demand
+        self._stale = False  # True if the table must be refit by _source
+        self._networks = weakref.WeakSet()  # networks to notify of changes
         self.ls_parents = ls_parents
-        self.cpt = None  # to be generated by BN.model.fit()
+        self._states = None
+        self._state_codes = None
+        self._table = None  # to be generated by BN.model.fit()
+        self._cpt = None  # dataframe view of table, built on demand
 
-    def specify_cpt(node, probs):
+    def specify_cpt(node, probs, default=None):
         """manually specify cpt for node.
 
-        probs is a dictionary. each key represents a random variable 
-        corresponding to the node's parent. each value is a list of possible 
-        states for the random variable. 
+        probs is a dictionary. each key represents a random variable
+        corresponding to the node's parent, or a state of the node. each value
+        is a list of possible states for the random variable, or of the
+        probabilities of the state for each parent configuration.
 
-        for example, a sample probs would be: 
+        for example, a sample probs would be:
 
-        p = {  'rain':          [False, False, True, True], 
+        p = {  'rain':          [False, False, True, True],
                 'sprinkler':    [False, True, False, True],
-                'True':         [1, 1, .5, .5]}
+                True:           [1, 1, .5, .5],
+                False:          [0, 0, .5, .5]}
+
+        states may be of any type and number. a binary node may give the
+        probability of True alone, under the key True or 'True'.
+
+        parent configurations that are not listed get a uniform distribution,
+        or, if default is given, the default distribution: a list of 
+        probabilities, in the order of the sorted states, or the probability 
+        of True for a binary node. with a default, only the listed 
+        configurations are stored (see tables.SparseTable), so a node with 
+        many parents only needs the configurations that differ from the 
+        default.
         """
-    
+
         # assert user specified cpt contains all parents
         for parent in node.parents_names:
             if parent not in probs.keys():
                 raise ValueError("must specify cpt for all parents.")
-        
-        # assert new cpt does not contain non-parent nodes
-        for parent in probs.keys():
-            if (parent not in node.parents_names) and (parent is not "True"):
-                raise ValueError("new cpt contains a non-parent node.")
 
-        # impute probability of false since this is a binary random variable
-        prob_false = [1 - x for x in probs['True']]
-        probs["False"] = prob_false
+        # impute probability of false for a binary random variable
+        states = [k for k in probs.keys() if k not in node.parents_names]
+        probs = dict(probs)
+        if states in (["True"], [True]):
+            probs[True] = probs.pop(states[0])
+            probs[False] = [1 - x for x in probs[True]]
+            states = [False, True]
+
+        # assert new cpt does not contain non-parent nodes
+        values = [np.asarray(probs[s]) for s in states]
+        if not all(v.dtype.kind in "iuf" for v in values) or \
+                not np.allclose(np.sum(values, axis=0), 1):
+            raise ValueError("new cpt contains a non-parent node, or probabilities "
+                             "that do not sum to 1.")
 
-        # convert cpt into a dataframe since node cpt's are dataframes
+        # convert cpt into a dataframe and compile it
         new_cpt = pd.DataFrame(probs)  # column order does not matter
-        node.cpt = new_cpt
+        if default is None:
+            node.cpt = new_cpt
+        else:
+            if np.ndim(default) == 0:
+                default = [1 - default, default]
+            node._compile_cpt(new_cpt, default)
         return True
 
+    @property
+    def cpt(self):
+        """conditional probability table as a dataframe, with one column per
+        parent and one column per state.
+
+        the dataframe is a view of the compiled table, built on first access
+        and meant for inspection; sampling reads the table directly. a sparse
+        table only lists its stored parent configurations.
+        """
+        if self.table is None:
+            return None
+
+        if self._cpt is None:
+            if isinstance(self.table, tables.SparseTable):
+                probs = self.table.rows
+                codes = np.unravel_index(self.table.keys, self.table.shape[:-1])
+                configurations = list(zip(*[np.array(p.states, dtype=object)[c] 
+                                            for (p, c) in zip(self.ls_parents, codes)]))
+            else:
+                # enumerate parent configurations in the table's row order
+                probs = self.table.reshape(-1, len(self.states))
+                configurations = list(itertools.product(*[p.states for p in self.ls_parents]))
+            cpt = pd.DataFrame(probs, columns=self.states)
+            for (i, parent) in enumerate(self.parents_names):
+                cpt.insert(i, parent, [c[i] for c in configurations])
+            self._cpt = cpt
+        return self._cpt
+
+    @cpt.setter
+    def cpt(self, cpt):
+        """compile a dataframe cpt, with one column per parent and one column
+        per state, into the node's table.
+
+        parent configurations missing from the dataframe fall back to a
+        uniform distribution.
+        """
+        self._compile_cpt(cpt)
+
+    def _compile_cpt(self, cpt, default=None):
+        """compile a dataframe cpt. parent configurations missing from it get 
+        the default distribution, or a uniform one. the table is sparse if a 
+        default is given or the dense table would be too large.
+        """
+        if cpt is None:
+            self._table = None
+            self._cpt = None
+            self._source = None
+            self._stale = False
+            self._notify()
+            return
+
+        columns = list(cpt.columns)
+        states = sorted(c for c in columns if c not in self.parents_names)
+        probs = np.column_stack([cpt.iloc[:, columns.index(s)].values for s in states])
+
+        # a parent's states come from the parent itself when known
+        parent_states = []
+        for parent in self.ls_parents:
+            if parent.states is None:
+                parent_states.append(sorted(cpt[parent.name].unique()))
+            else:
+                parent_states.append(list(parent.states))
+
+        shape = tuple(len(s) for s in parent_states)
+        sparse = default is not None and len(cpt) < np.prod(shape) or \
+            np.prod(shape + (len(states),), dtype=float) > tables.MAX_DENSE_SIZE
+        if default is None:
+            default = np.full(len(states), 1. / len(states))
+        if self.is_marginal:
+            self.compile(states, probs[0])
+            return
+
+        index = []
+        for (parent, pstates) in zip(self.parents_names, parent_states):
+            lookup = dict((s, i) for (i, s) in enumerate(pstates))
+            index.append(cpt[parent].map(lookup).values)
+
+        if sparse:
+            (keys, first) = np.unique(np.ravel_multi_index(tuple(index), shape), return_index=True)
+            table = tables.SparseTable(shape + (len(states),), keys, probs[first], default)
+        else:
+            table = np.empty(shape + (len(states),))
+            table[:] = default
+            table[tuple(index)] = probs
+
+        self.compile(states, table)
+
+    def compile(self, states, table):
+        """set the node's states and compiled table. the table is replaced 
+        when it is compiled again, or when a network the node belongs to is 
+        fit.
+        """
+        self._states = list(states)
+        self._state_codes = dict((s, i) for (i, s) in enumerate(self._states))
+        if not isinstance(table, tables.SparseTable):
+            table = np.asarray(table, dtype=float)
+        self._table = table
+        self._cpt = None
+        self._source = None
+        self._stale = False
+        self._notify()
+
+    def _invalidate(self, source, states=False):
+        """mark the table (and the states, if states) as stale, to be refit by 
+        source on first access.
+        """
+        self._source = source
+        self._stale = True
+        self._cpt = None
+        self._notify()
+        if states:
+            self._states = None
+            self._state_codes = None
+
+    def _notify(self, graph=False):
+        """tell the node's networks that its table, and its parents if graph,
+        changed.
+        """
+        for network in list(self._networks):
+            network._changed(graph)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_networks"]  # weak references can't be pickled
+        return state
+
+    def __setstate__(self, state):
+        # a network may have registered itself before the node is restored
+        networks = self.__dict__.get("_networks", weakref.WeakSet())
+        self.__dict__.update(state)
+        self._networks = networks
+
+    @property
+    def states(self):
+        """possible states, computed on first access if the node is stale.
+        """
+        if self._states is None and self._stale:
+            self._source._fit_states(self)
+        return self._states
+
+    @property
+    def state_codes(self):
+        if self._states is None and self._stale:
+            self._source._fit_states(self)
+        return self._state_codes
+
+    @property
+    def table(self):
+        """compiled cpt, refit on first access if the node is stale.
+        """
+        if self._stale:
+            self._source._fit_node(self)
+        return self._table
+
+    @property
+    def ls_parents(self):
+        """a list of parents' nodes. assigning a new list marks the graph 
+        index of the node's networks, and this node's table, as stale.
+        """
+        return self._ls_parents
+
+    @ls_parents.setter
+    def ls_parents(self, ls_parents):
+        self._ls_parents = list(ls_parents)
+        self._notify(graph=True)
+        if self._source is not None:
+            self._invalidate(self._source)
+
     @property
     def parents_nodes(self):
         """a list of parents' nodes.
         """
         return self.ls_parents
-    
+
     @property
     def parents_names(self):
         """a list of parents' names.
         """
         return list(map(lambda x: x.name, self.ls_parents))
-        
+
     @property
     def is_marginal(self):
         """a marginal node does not have any parents.
         """
         return not self.ls_parents
-    
+
     def sample(self, parent_states=None, num_samples=1):
-        """sample from node, according to (1) the node's conditional probability 
-        table and (2) its parents' states. 
+        """sample from node, according to (1) the node's conditional probability
+        table and (2) its parents' states.
 
-        while a node knows who its parents are, it does not know its parent's 
+        while a node knows who its parents are, it does not know its parent's
         state. that's because the parent is a node, which is a random variable.
+        parent_states is a list of the parents' states, ordered like ls_parents.
         """
-        
-        # check if its cpt has been computed 
-        if self.cpt is None:
+
+        # look up the parents' codes by their states
+        parent_codes = parent_states
+        if parent_states is not None and not self.is_marginal and self.table is not None:
+            parent_codes = [p.state_codes[s] for (p, s) in zip(self.ls_parents, parent_states)]
+
+        codes = self.sample_codes(parent_codes, num_samples)
+        return np.array(self.states)[codes]
+
+    def sample_codes(self, parent_codes=None, num_samples=1):
+        """like sample(), but the parents' states and the samples are state 
+        codes, ie positions in each node's states.
+        """
+
+        # check if its cpt has been computed
+        if self.table is None:
             raise ValueError('need to fit model with observations.')
 
         # non-marginal nodes must know about parents' states
-        if not self.is_marginal and parent_states is None:
+        if not self.is_marginal and parent_codes is None:
             raise ValueError("node needs its parent's states.")
 
-        temp_cpt = self.cpt.copy(deep=True)  # df are mutable so create deep copy
-        
-        # if node is not a marginal, filter its cpt by parents' state 
-        if not self.is_marginal:
-            
-            # iteratively filter cpt
-            for parent_state in parent_states:
-                temp_cpt = temp_cpt.query(parent_state)
-
-            # then drop unnecssary columns, which correspond to parents' cols
-            for column in self.parents_names:
-                temp_cpt = temp_cpt.drop(column, axis=1)  # https://stackoverflow.com/questions/32752299/pandas-warning-while-trying-to-delete-column
-            
+        # look up the distribution for the parents' codes
+        if self.is_marginal:
+            distribution = self.table
+        else:
+            distribution = self.table[tuple(parent_codes)]
+
         # finally, draw from probability distribution
-        states = np.array(temp_cpt.columns)  # possible states
-        distribution = np.array(temp_cpt)  # corresponding distribution
-        return np.random.choice(a=states, size=num_samples, p=distribution[0])
\ No newline at end of file
+        codes = np.random.choice(len(self.states), size=num_samples, p=distribution)
+        instrument.count("samples_drawn", num_samples)
+        return codes
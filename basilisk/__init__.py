@@ -1,2 +1,4 @@
 from .Basilisk import BN
-from .Node import Node
\ No newline at end of file
+from .Node import Node
+from .JunctionTree import JunctionTree
+from .encoding import Dataset
@@ -0,0 +1,26 @@
+import unittest
+import numpy as np
+
+from basilisk import BN
+from basilisk.benchmarks import random_network, synthesize, compare
+
+class test_benchmarks(unittest.TestCase):
+    def test_random_network(self):
+        nodes = random_network(30, max_in_degree=2, cardinality=(2, 4), sparsity=0.5, random_state=0)
+        self.assertTrue(all(len(n.ls_parents) <= 2 for n in nodes))
+        self.assertTrue(np.allclose(nodes[-1].table.sum(axis=-1), 1.))
+        
+        # a network fitted to enough synthetic data recovers its cpts, less
+        # the states that sparsity made impossible
+        data = synthesize(nodes, 50000, random_state=0)
+        self.assertEqual(list(data.columns), [n.name for n in nodes])
+        fitted = random_network(30, max_in_degree=2, cardinality=(2, 4), sparsity=0.5, random_state=0)
+        BN(fitted).fit(data)
+        table = nodes[0].table
+        self.assertEqual(fitted[0].states, [s for s in nodes[0].states if table[s] > 0])
+        self.assertTrue(np.allclose(fitted[0].table, table[table > 0], atol=0.01))
+        
+    def test_compare(self):
+        baseline = {"results": {"fit/n=10": 1.0, "dsep/n=10": 1e-5, "query/n=10": 1.0}}
+        results = {"results": {"fit/n=10": 1.5, "dsep/n=10": 1e-4, "query/n=10": 1.1}}
+        self.assertEqual(compare(results, baseline, tolerance=0.25), {"fit/n=10": (1.0, 1.5)})
@@ -1,11 +1,17 @@
 import unittest
 import os
+import tempfile
 from os.path import dirname
 from basilisk import Node, BN
 import numpy as np
 import pandas as pd
 
-from basilisk.structure import calc_mi
+from basilisk import encoding, structure
+from basilisk.structure import calc_mi, calc_cmi, mi_matrix, CountCache, dsep, pc_basic, CITestCache, FamilyScores, hill_climb, \
+    cmi_matrix, chow_liu, tan
+
+def edges(nodes):
+    return sorted((p, n.name) for n in nodes for p in n.parents_names)
 
 class test_structure(unittest.TestCase):
     def setUp(self):
@@ -16,4 +22,135 @@ class test_structure(unittest.TestCase):
         testdata = self.data[['cloudy', 'rain']].values.astype(int)
         testbins = [2, 2]
         
-        self.assertEqual(np.around(calc_mi(testdata, testbins ), 3), 0.1800)
\ No newline at end of file
+        self.assertEqual(np.around(calc_mi(testdata, testbins ), 3), 0.1800)
+
+        # values are binned like np.histogramdd, eg four levels into two bins
+        coarse = np.column_stack([np.arange(400) % 4, np.arange(400) % 4])
+        self.assertAlmostEqual(calc_mi(coarse, [2, 2]), np.log(2), places=6)
+
+    def test_cmi(self):
+        testdata = self.data[['sprinkler', 'rain']].values.astype(int)
+        conddata = self.data[['cloudy']].values.astype(int)
+        
+        # I(S;R|C) = H(S,C) + H(R,C) - H(S,R,C) - H(C)
+        def entropy(cols):
+            p = self.data.groupby(cols).size().values / float(len(self.data))
+            return -np.sum(p * np.log(p))
+        expected = (entropy(['sprinkler', 'cloudy']) + entropy(['rain', 'cloudy']) 
+                    - entropy(['sprinkler', 'rain', 'cloudy']) - entropy(['cloudy']))
+        
+        self.assertAlmostEqual(calc_cmi(testdata, [2, 2], conddata, [2]), expected, places=6)
+        
+    def test_mi_matrix(self):
+        data = self.data.astype(int)
+        mi = mi_matrix(data)
+        
+        self.assertAlmostEqual(mi.loc['cloudy', 'rain'], calc_mi(data[['cloudy', 'rain']].values, [2, 2]), places=6)
+        self.assertTrue(np.allclose(mi.values, mi.values.T))
+        
+        # counting in small chunks gives the same tables
+        cache = CountCache(data)
+        counts, offsets = cache.pair_counts(cache.columns)
+        self.assertTrue(np.array_equal(cache.pair_counts(cache.columns, chunk_size=5)[0], counts))
+        self.assertEqual(counts[offsets[0]:offsets[1], offsets[0]:offsets[1]].sum(), len(data))
+        
+    def test_count_cache(self):
+        data = self.data.astype(int)
+        cache = CountCache(data)
+        
+        for _ in range(2):
+            for z in [[], ['cloudy']]:
+                self.assertEqual(dsep(data[['sprinkler', 'rain']], data[z], cache=cache), 
+                                 dsep(data[['sprinkler', 'rain']], data[z]))
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        self.assertTrue(np.array_equal(cache.counts(['rain', 'cloudy']), cache.counts(['cloudy', 'rain']).T))
+
+    def test_dsep_categorical(self):
+        data = self.data.astype(int)
+        labels = self.data.replace({True: 'yes', False: 'no'})
+        
+        for z in [[], ['cloudy'], ['cloudy', 'wet']]:
+            self.assertEqual(dsep(data[['sprinkler', 'rain']], data[z]),
+                             dsep(labels[['sprinkler', 'rain']], labels[z]))
+        
+    def test_combine(self):
+        codes, n_codes = encoding.combine([np.array([0, 1, 1, 0, 2]), np.array([3, 0, 0, 3, -1])], [3, 4])
+        
+        self.assertEqual(n_codes, 2)
+        self.assertEqual(list(codes), [0, 1, 1, 0, -1])
+        
+        # 100**10 combinations do not fit in an int64 index
+        columns = [np.arange(50) % 100 for _ in range(10)]
+        codes, n_codes = encoding.combine(columns, [100] * 10)
+        self.assertEqual(n_codes, 50)
+        self.assertEqual(list(codes), list(range(50)))
+
+    def test_pc_stable(self):
+        data = pd.read_csv(os.path.join(self.dir, 'obs_v3.csv'))
+        
+        expected = edges(pc_basic(data))
+        self.assertEqual(edges(pc_basic(data[data.columns[::-1]])), expected)
+        self.assertEqual(edges(pc_basic(data, n_jobs=2)), expected)
+        
+        # an in-process pool doesn't keep the dataset alive once it's closed
+        self.assertIsNone(structure._cache)
+        self.assertIsNone(structure._ci_cache)
+
+    def test_ci_cache(self):
+        data = pd.read_csv(os.path.join(self.dir, 'obs_v3.csv'))
+        
+        expected = edges(pc_basic(data))
+        ci_cache = CITestCache(CITestCache.fingerprint_of(data))
+        self.assertEqual(edges(pc_basic(data, ci_cache=ci_cache)), expected)
+        self.assertEqual(ci_cache.hits, 0)
+        
+        # a second run, even with another alpha, is answered from the cache
+        misses = ci_cache.misses
+        pc_basic(data, alpha=0.01, ci_cache=ci_cache)
+        self.assertGreater(ci_cache.hits, 0)
+        
+        # a checkpoint on disk resumes, and is ignored for other data
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ci.pkl')
+            self.assertEqual(edges(pc_basic(data, ci_cache=path)), expected)
+            loaded = CITestCache.load(path, CITestCache.fingerprint_of(data))
+            self.assertEqual(len(loaded.pvalues), misses)
+            self.assertEqual(len(CITestCache.load(path, CITestCache.fingerprint_of(data[:100])).pvalues), 0)
+
+    def test_hill_climb(self):
+        data = pd.read_csv(os.path.join(self.dir, 'obs_v3.csv'))
+        
+        # tabu search recovers the network the data was sampled from
+        nodes = hill_climb(data, tabu_length=10)
+        self.assertEqual(edges(nodes), [('A', 'C'), ('B', 'A'), ('C', 'R'), ('C', 'S'), 
+                                        ('R', 'W'), ('S', 'W'), ('T', 'R')])
+        BN(nodes).fit(data)
+        
+        # family scores are reused across searches
+        scores = FamilyScores(data, 'bdeu')
+        nodes = hill_climb(data, scores=scores, max_parents=1, whitelist=[('T', 'W')], 
+                           blacklist=[('C', 'R'), ('R', 'C')])
+        self.assertIn(('T', 'W'), edges(nodes))
+        self.assertFalse(set([('C', 'R'), ('R', 'C')]) & set(edges(nodes)))
+        self.assertTrue(all(len(n.ls_parents) <= 1 for n in nodes))
+        misses = scores.misses
+        hill_climb(data, scores=scores, max_parents=1, whitelist=[('T', 'W')], 
+                   blacklist=[('C', 'R'), ('R', 'C')])
+        self.assertEqual(scores.misses, misses)
+
+    def test_chow_liu(self):
+        data = pd.read_csv(os.path.join(self.dir, 'obs_v3.csv'))
+        
+        nodes = chow_liu(data, root='B')
+        self.assertEqual(edges(nodes), [('A', 'C'), ('B', 'A'), ('C', 'S'), 
+                                        ('R', 'T'), ('S', 'W'), ('W', 'R')])
+        BN(nodes).fit(data)
+        
+        # tan: the class is a parent of every feature, which also form a tree
+        cmi = cmi_matrix(data, 'W')
+        codes = CountCache(data).codes
+        self.assertAlmostEqual(cmi.loc['A', 'C'], calc_cmi(np.column_stack([codes['A'], codes['C']]), [2, 2], 
+                                                           codes['W'][:, None], [2]))
+        nodes = tan(data, 'W')
+        self.assertEqual(sum(len(n.ls_parents) for n in nodes), 2 * len(nodes) - 3)
+        self.assertTrue(all(n.parents_names[:1] == ['W'] for n in nodes if n.name != 'W'))
@@ -0,0 +1,9 @@
+"""
+benchmarks for basilisk: a generator of random networks and datasets, and a
+timing suite whose results can be compared against a saved baseline.
+
+run it with `python -m basilisk.benchmarks --help`.
+"""
+
+from .networks import random_network, synthesize
+from .suite import run, compare
@@ -0,0 +1,42 @@
+"""
+python -m basilisk.benchmarks [--sizes 10 50 200] [--output results.json] 
+                              [--baseline baseline.json] [--tolerance 0.25]
+
+exits with status 1 if any benchmark regressed against the baseline.
+"""
+
+import argparse
+import sys
+from .suite import run, compare, save, load
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m basilisk.benchmarks",
+                                     description="time basilisk on random networks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200],
+                        help="number of nodes of each network")
+    parser.add_argument("--samples", type=int, default=10000, help="observations per network")
+    parser.add_argument("--in-degree", type=int, default=3, help="most parents per node")
+    parser.add_argument("--cardinality", type=int, default=2, help="states per node")
+    parser.add_argument("--sparsity", type=float, default=0., help="fraction of zero cpt entries")
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many runs")
+    parser.add_argument("--output", help="write results to this json file")
+    parser.add_argument("--baseline", help="compare against the results in this json file")
+    parser.add_argument("--tolerance", type=float, default=0.25, 
+                        help="allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.samples, args.in_degree, args.cardinality, 
+                  args.sparsity, args.repeat, verbose=True)
+    if args.output:
+        save(results, args.output)
+
+    if args.baseline:
+        regressions = compare(results, load(args.baseline), args.tolerance)
+        for (key, (old, new)) in sorted(regressions.items()):
+            print("regression: {} {:.6f}s -> {:.6f}s".format(key, old, new))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+random bayesian networks of any size, and vectorized sampling of datasets from
+them.
+"""
+
+import numpy as np
+import pandas as pd
+from ..Node import Node
+from .. import sampling
+
+def random_network(n_nodes, max_in_degree=3, cardinality=2, sparsity=0., 
+                   concentration=1., random_state=None):
+    """return a list of nodes with compiled cpts, wired as a random dag.
+
+    nodes are named 'X0', 'X1', ... and only draw parents from earlier nodes, 
+    so the list is in topological order. each node gets between 0 and 
+    max_in_degree parents.
+
+    cardinality is the number of states of every node, or a (low, high) range 
+    to draw each node's from. states are the integers 0 .. cardinality - 1.
+
+    each row of a cpt is drawn from a dirichlet with the given concentration. 
+    sparsity is the fraction of entries of each row that are set to zero (a 
+    row always keeps at least one state).
+    """
+    rng = np.random.default_rng(random_state)
+    if np.isscalar(cardinality):
+        cards = np.full(n_nodes, int(cardinality))
+    else:
+        cards = rng.integers(cardinality[0], cardinality[1] + 1, n_nodes)
+
+    nodes = []
+    for i in range(n_nodes):
+        k = rng.integers(0, min(i, max_in_degree) + 1)
+        parents = [nodes[j] for j in sorted(rng.choice(i, k, replace=False))]
+        node = Node("X{}".format(i), parents)
+
+        card = int(cards[i])
+        shape = tuple(len(p.states) for p in parents) + (card,)
+        table = rng.dirichlet(np.full(card, concentration), shape[:-1] or None)
+        table = table.reshape(shape)
+        if sparsity > 0 and card > 1:
+            n_zero = min(int(round(sparsity * card)), card - 1)
+            ranks = rng.random(shape).argsort(axis=-1).argsort(axis=-1)
+            table = np.where(ranks < n_zero, 0., table)
+            table = table / table.sum(axis=-1, keepdims=True)
+
+        node.compile(range(card), table)
+        nodes.append(node)
+    return nodes
+
+def synthesize(nodes, n_samples, random_state=None):
+    """return a dataframe of n_samples joint observations of nodes, which 
+    must be in topological order, eg as returned by random_network().
+
+    every node is sampled for all rows at once, with the same compiled plan
+    BN.generate_samples() uses.
+    """
+    rng = np.random.default_rng(random_state)
+    codes, _ = sampling.sample(sampling.compile_plan(nodes), n_samples, rng)
+    return pd.DataFrame(dict((node.name, np.asarray(node.states)[codes[:, i]])
+                             for (i, node) in enumerate(nodes)),
+                        columns=[node.name for node in nodes])
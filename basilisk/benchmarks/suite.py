@@ -0,0 +1,109 @@
+"""
+times basilisk's main operations on random networks of increasing size.
+
+results are a json-serializable dict, where each benchmark is keyed by 
+'<operation>/n=<number of nodes>' and holds the best wall time in seconds over
+several repeats. compare() flags benchmarks that got slower than a baseline.
+"""
+
+import json
+import platform
+import time
+import numpy as np
+from .. import BN
+from .. import structure
+from .networks import random_network, synthesize
+
+def _best_time(func, setup=None, repeat=3):
+    """return the fastest of repeat calls to func, in seconds. setup is 
+    called (untimed) before each call.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _fit(nodes, data):
+    """fit a new network to data, counting every family now rather than on
+    first access, so the whole fit is timed.
+    """
+    bn = BN(nodes)
+    bn.fit(data)
+    bn._materialize()
+    return bn
+
+def _benchmarks(nodes, data, n_samples, pc_max_nodes):
+    """return a list of (operation, func, setup) to time on one network.
+    """
+    bn = BN(nodes)
+    bn.fit(data)
+    leaf = nodes[-1]
+    names = list(data.columns)
+    codes = data.values
+
+    benchmarks = [
+        ("BN.__init__", lambda: BN(nodes), None),
+        ("fit", lambda: _fit(nodes, data), None),
+        ("scheduler", lambda: bn.scheduler(leaf), bn.invalidate),
+        ("generate_samples", lambda: bn.generate_samples(leaf, n_samples, random_state=0), None),
+        ("calc_mi", lambda: structure.calc_mi(codes[:, :2], [2, 2]), None),
+        ("calc_cmi", lambda: structure.calc_cmi(codes[:, :2], [2, 2], codes[:, 2:4], [2, 2]), None),
+        ("dsep", lambda: structure.dsep(data[names[:2]], data[names[2:4]]), None),
+    ]
+    if len(nodes) <= pc_max_nodes:
+        benchmarks.append(("pc_basic", lambda: structure.pc_basic(data), None))
+    return benchmarks
+
+def run(sizes=(10, 50, 200), n_samples=10000, max_in_degree=3, cardinality=2,
+        sparsity=0., repeat=3, pc_max_nodes=20, random_state=0, verbose=False):
+    """time every operation on a random network of each size, fitted to 
+    n_samples synthetic observations. pc_basic is only timed on networks of 
+    up to pc_max_nodes nodes, since it grows exponentially.
+
+    returns a dict with the settings used ('meta') and the timings 
+    ('results').
+    """
+    results = {}
+    for n_nodes in sizes:
+        nodes = random_network(max(n_nodes, 4), max_in_degree, cardinality, sparsity, 
+                               random_state=random_state)
+        data = synthesize(nodes, n_samples, random_state=random_state)
+
+        for (operation, func, setup) in _benchmarks(nodes, data, n_samples, pc_max_nodes):
+            key = "{}/n={}".format(operation, n_nodes)
+            results[key] = _best_time(func, setup, repeat)
+            if verbose:
+                print("{:<32}{:>12.6f}s".format(key, results[key]))
+
+    meta = {"sizes": list(sizes), "n_samples": n_samples, "max_in_degree": max_in_degree,
+            "cardinality": cardinality, "sparsity": sparsity, "repeat": repeat,
+            "random_state": random_state, "python": platform.python_version(), 
+            "numpy": np.__version__}
+    return {"meta": meta, "results": results}
+
+def compare(results, baseline, tolerance=0.25, min_seconds=1e-3):
+    """return a dict of the benchmarks that are more than tolerance (a 
+    fraction) slower than in baseline, where k = benchmark and v = (baseline 
+    seconds, new seconds). benchmarks faster than min_seconds in both runs 
+    are too noisy to compare and are skipped.
+    """
+    regressions = {}
+    old = baseline["results"]
+    for (key, seconds) in results["results"].items():
+        if key not in old or max(old[key], seconds) < min_seconds:
+            continue
+        if seconds > old[key] * (1. + tolerance):
+            regressions[key] = (old[key], seconds)
+    return regressions
+
+def save(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
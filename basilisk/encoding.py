@@ -0,0 +1,226 @@
+"""
+integer encoding of categorical columns, and count tables over encoded columns.
+
+a Dataset holds a table of categorical columns encoded once into small integer
+codes and a dict of states, so fitting, sampling and structure learning all 
+work on the same codes instead of parsing values again.
+"""
+
+import numpy as np
+import pandas as pd
+
+def encode(values, states):
+    """return an array of integer codes for values.
+
+    states is a dict, where k = state and v = code. states seen for the first 
+    time are added to it, so a column can be encoded chunk by chunk with 
+    consistent codes. missing values are coded -1.
+    """
+    codes, uniques = pd.factorize(values)
+    return recode(codes, uniques, states)
+
+def code_dtype(n_states):
+    """return the smallest signed integer type that holds the codes of 
+    n_states states, and -1 for missing values.
+    """
+    return np.min_scalar_type(-max(n_states, 1))
+
+def recode(codes, ls_states, states):
+    """return codes of ls_states (a list of states, in code order) as codes 
+    of states, a dict where k = state and v = code. states seen for the first
+    time are added to it.
+    """
+    lookup = np.array([states.setdefault(s, len(states)) for s in ls_states], dtype=np.intp)
+    if len(lookup) == 0:
+        return np.full(len(codes), -1, dtype=np.intp)
+    return np.where(codes < 0, -1, lookup[codes])
+
+class Dataset(object):
+    """
+    a table of categorical columns, each encoded once into integer codes of 
+    the smallest type that fits, and a dict of its states. columns of a 
+    dataframe are encoded on first use, so work that only touches some 
+    columns of a wide dataframe only encodes those.
+
+    parameters
+    ----------
+    data : pandas dataframe
+        columns may hold any categorical values (bool, str, int). missing
+        values are coded -1.
+
+
+    attributes
+    ----------
+    columns : list
+        column names.
+
+    states : dictionary
+        key represents column name, value is a dict, where k = state and v =
+        code. only holds the columns encoded so far.
+    """
+
+    def __init__(self, data=None):
+        self.data = data
+        self.columns = [] if data is None else list(data.columns)
+        self.n = 0 if data is None else len(data)
+        self.states = {}
+        self._codes = {}
+
+    @classmethod
+    def from_codes(cls, codes, states):
+        """return a dataset of columns that are already encoded. codes is a 
+        dict, where k = column name and v = array of codes, and states is a 
+        dict, where k = column name and v = list of states in code order.
+        """
+        dataset = cls()
+        for (name, column) in codes.items():
+            dataset.add(name, column, dict((s, i) for (i, s) in enumerate(states[name])))
+        return dataset
+
+    def __len__(self):
+        return self.n
+
+    def add(self, name, codes, states):
+        """add, or replace, an encoded column.
+        """
+        if name not in self.columns:
+            self.columns.append(name)
+        self.n = len(codes)
+        self.states[name] = states
+        self._codes[name] = np.asarray(codes).astype(code_dtype(len(states)), copy=False)
+
+    def codes(self, name):
+        """return the codes of a column, encoding it on first use.
+        """
+        if name not in self._codes:
+            states = {}
+            self.add(name, encode(self.data[name].values, states), states)
+        return self._codes[name]
+
+    def card(self, name):
+        """return the number of states of a column.
+        """
+        self.codes(name)
+        return len(self.states[name])
+
+    def ls_states(self, name):
+        """return the states of a column as a list, in code order.
+        """
+        self.codes(name)
+        ls = [None] * len(self.states[name])
+        for (state, code) in self.states[name].items():
+            ls[code] = state
+        return ls
+
+    def recode(self, name, states):
+        """return the codes of a column under another dict of states (k = 
+        state, v = code), adding the states it has not seen, eg to count a 
+        chunk against a model's states.
+        """
+        if name not in self._codes and self.data is not None:
+            return encode(self.data[name].values, states)
+        return recode(self.codes(name), self.ls_states(name), states)
+
+    def equals(self, other, name):
+        """return True if a column holds the same values in both datasets.
+        """
+        if self is other:
+            return True
+        if name not in other.columns:
+            return False
+        if self.data is not None and other.data is not None:
+            return self.data[name].equals(other.data[name])
+        return self.ls_states(name) == other.ls_states(name) and \
+            np.array_equal(self.codes(name), other.codes(name))
+
+    def decode(self, name):
+        """return the values of a column. missing values are nan.
+        """
+        codes = self.codes(name)
+        values = np.array(self.ls_states(name) or [np.nan])[codes]
+        if (codes < 0).any():
+            values = values.astype(object)
+            values[codes < 0] = np.nan
+        return values
+
+    def to_frame(self, columns=None):
+        """return the columns as a dataframe, with one typed column per 
+        column.
+        """
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame(dict((name, self.decode(name)) for name in columns), columns=columns)
+
+def count(codes, cards):
+    """return a count table of shape cards, given one code array per axis.
+
+    each row's codes are combined into a single mixed-radix index, so the 
+    whole table is filled by one np.bincount. rows with a missing code (-1) 
+    are skipped.
+    """
+    cards = tuple(cards)
+    if len(codes) == 0:
+        return np.zeros(cards)
+    codes = np.stack(codes)
+    codes = codes[:, (codes >= 0).all(axis=0)]
+    index = np.ravel_multi_index(codes, cards)
+    return np.bincount(index, minlength=int(np.prod(cards))).reshape(cards).astype(float)
+
+def combine(codes, cards, max_dense=2**24):
+    """return the joint codes of several columns as one dense code per row, 
+    and the number of distinct joint codes.
+
+    columns are folded into a mixed-radix index and then renumbered so only 
+    combinations that occur get a code. columns are folded in as long as the
+    index fits in an int64, then renumbered before the next ones are folded
+    in, so columns with many levels never overflow. renumbering uses a lookup
+    table when there are few possible combinations, otherwise np.unique. rows
+    with a missing code (-1) stay missing.
+    """
+    codes = [np.asarray(c) for c in codes]
+    valid = np.ones(len(codes[0]), dtype=bool)
+    for c in codes:
+        valid &= c >= 0
+
+    index = np.zeros(len(valid), dtype=np.int64)
+    size = 1
+    for (c, card) in zip(codes, cards):
+        if size * int(card) >= 2**62:
+            index, size = _renumber(index, size, valid, max_dense)
+        index = index * int(card) + np.where(valid, c, 0)
+        size *= int(card)
+    dense, n_codes = _renumber(index, size, valid, max_dense)
+    return np.where(valid, dense, -1), n_codes
+
+def _renumber(index, size, valid, max_dense):
+    """return index (of at most size values) renumbered densely over the 
+    values that occur in valid rows, and the number of codes.
+    """
+    if size <= max_dense:
+        present = np.bincount(index[valid], minlength=size) > 0
+        lookup = np.cumsum(present) - 1
+        return lookup[index], int(present.sum())
+    uniques, inverse = np.unique(index[valid], return_inverse=True)
+    dense = np.zeros(len(index), dtype=np.int64)
+    dense[valid] = inverse.ravel()
+    return dense, len(uniques)
+
+def pad(table, cards):
+    """return table zero-padded at the end of each axis up to shape cards, eg
+    after new states were seen in a later chunk.
+    """
+    widths = [(0, c - s) for (s, c) in zip(table.shape, cards)]
+    if not any(w for (_, w) in widths):
+        return table
+    return np.pad(table, widths, mode='constant')
+
+def sort_states(states):
+    """return a dict of states (k = state, v = code) as a sorted list of states
+    and the permutation that maps sorted positions to the original codes. 
+    states that cannot be compared keep the order they were first seen in.
+    """
+    ls = list(states)
+    try:
+        ls = sorted(ls)
+    except TypeError:
+        pass
+    return ls, np.array([states[s] for s in ls], dtype=np.intp)
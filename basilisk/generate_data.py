@@ -33,29 +33,28 @@ def is_wet(sprinkler, rain):
     else:
         return False
 
-# generate toy dataset via sampling (we couldve done this by multiplying probabilities)
-n_samples = 10000
-
-ls_c = []
-ls_s = []
-ls_r = []
-ls_w = []
-
-for _ in range(n_samples):
-    c = is_cloudy()
-    s = is_sprinkler(c)
-    r = is_rain(c)
-    w = is_wet(s, r)
-    
-    ls_c.append(c)
-    ls_s.append(s)
-    ls_r.append(r)
-    ls_w.append(w)
-
-collection = {"cloudy": ls_c, "sprinkler": ls_s, "rain": ls_r, "wet": ls_w}
-
-# joint observations
-df = pd.DataFrame(collection)
-df.head()
-
-df.to_csv("observations.csv")
\ No newline at end of file
+if __name__ == "__main__":
+    # generate toy dataset via sampling (we couldve done this by multiplying probabilities)
+    n_samples = 10000
+
+    ls_c = []
+    ls_s = []
+    ls_r = []
+    ls_w = []
+
+    for _ in range(n_samples):
+        c = is_cloudy()
+        s = is_sprinkler(c)
+        r = is_rain(c)
+        w = is_wet(s, r)
+
+        ls_c.append(c)
+        ls_s.append(s)
+        ls_r.append(r)
+        ls_w.append(w)
+
+    collection = {"cloudy": ls_c, "sprinkler": ls_s, "rain": ls_r, "wet": ls_w}
+
+    # joint observations
+    df = pd.DataFrame(collection)
+    df.to_csv("observations.csv")
@@ -0,0 +1,154 @@
+"""
+exact inference over a fitted BN.
+
+a factor is a (scope, table) pair, where scope is a list of node names and
+table is a numpy array with one axis per name in scope, indexed by state codes.
+a node's compiled table is already a factor over its parents and itself.
+"""
+
+import numpy as np
+from .tables import SparseTable
+
+def node_factor(node, evidence=None):
+    """return the factor represented by a node's compiled cpt, reduced by 
+    evidence if given (see reduce_factor()).
+
+    a sparse cpt (see tables.SparseTable) is reduced before it is expanded to
+    a dense table, so only the cells consistent with the evidence are built.
+    """
+    if node.table is None:
+        raise ValueError('need to fit model with observations.')
+    scope = node.parents_names + [node.name]
+    evidence = evidence or {}
+    if isinstance(node.table, SparseTable):
+        index = tuple(evidence.get(v, slice(None)) for v in scope)
+        return ([v for v in scope if v not in evidence], node.table[index])
+    return reduce_factor((scope, node.table), evidence)
+
+def reduce_factor(factor, evidence):
+    """drop the axes of evidence variables from a factor by indexing them with
+    their observed codes. evidence is a dict, where k = node name and v = code.
+    """
+    scope, table = factor
+    index = tuple(evidence.get(v, slice(None)) for v in scope)
+    return ([v for v in scope if v not in evidence], table[index])
+
+def multiply(factors, keep=None):
+    """multiply factors together and sum out every variable not in keep.
+
+    the product and the marginalization are done in one np.einsum call, so
+    the full product table is never materialized when variables are summed
+    out. if keep is None, every variable is kept.
+    """
+    names = []
+    for (scope, _) in factors:
+        for v in scope:
+            if v not in names:
+                names.append(v)
+    keep = names if keep is None else [v for v in names if v in keep]
+    axes = dict((v, i) for (i, v) in enumerate(names))
+
+    operands = []
+    for (scope, table) in factors:
+        operands.append(table)
+        operands.append([axes[v] for v in scope])
+    operands.append([axes[v] for v in keep])
+    return (keep, np.einsum(*operands))
+
+def requisite_nodes(bn, targets, evidence):
+    """return the names of the nodes whose factors are needed to answer
+    P(targets | evidence).
+
+    first, barren nodes are pruned: only ancestors of targets and evidence can
+    affect the answer. then, evidence is removed from every factor's scope, 
+    which cuts the edges leaving evidence nodes. factors that are no longer 
+    connected to a target are pruned, since their variables are d-separated 
+    from the targets by the evidence.
+    """
+    # keep ancestors of the query and evidence variables
+    relevant = bn.ancestors(list(targets) + list(evidence))
+
+    # variables sharing a reduced factor are adjacent
+    scopes = {}
+    neighbors = dict((name, set()) for name in relevant if name not in evidence)
+    for name in relevant:
+        scope = [v for v in bn.dict_nodes[name].parents_names + [name] if v not in evidence]
+        scopes[name] = scope
+        for v in scope:
+            neighbors[v].update(scope)
+
+    # keep factors touching a variable reachable from the targets
+    reachable = set()
+    frontier = list(targets)
+    while frontier:
+        name = frontier.pop()
+        if name not in reachable:
+            reachable.add(name)
+            frontier.extend(neighbors[name])
+    return set(name for name in relevant if reachable.intersection(scopes[name]))
+
+def elimination_order(scopes, cards, eliminate, heuristic='min_fill'):
+    """greedily order the variables to eliminate.
+
+    scopes is a list of factor scopes, cards maps a name to its cardinality.
+    'min_fill' picks the variable whose elimination adds the fewest new edges
+    to the interaction graph, breaking ties by weight. 'min_weight' picks the
+    variable whose elimination creates the smallest factor.
+    """
+    if heuristic not in ('min_fill', 'min_weight'):
+        raise ValueError("heuristic must be 'min_fill' or 'min_weight'.")
+
+    # interaction graph: variables sharing a factor are adjacent
+    graph = dict((v, set()) for scope in scopes for v in scope)
+    for scope in scopes:
+        for v in scope:
+            graph[v].update(u for u in scope if u != v)
+
+    def weight(v):
+        return np.prod([cards[u] for u in graph[v]]) * cards[v]
+
+    def fill(v):
+        adj = list(graph[v])
+        return sum(1 for (i, a) in enumerate(adj) for b in adj[i + 1:] if b not in graph[a])
+
+    order = []
+    remaining = set(eliminate)
+    while remaining:
+        if heuristic == 'min_fill':
+            v = min(remaining, key=lambda u: (fill(u), weight(u), u))
+        else:
+            v = min(remaining, key=lambda u: (weight(u), u))
+
+        # connect v's neighbors, then remove v from the graph
+        adj = graph.pop(v)
+        for a in adj:
+            graph[a].update(u for u in adj if u != a)
+            graph[a].discard(v)
+        remaining.remove(v)
+        order.append(v)
+    return order
+
+def eliminate(factors, order):
+    """sum the variables in order out of a list of factors, one at a time, 
+    and return the remaining factors.
+    """
+    factors = list(factors)
+    for v in order:
+        involved = [f for f in factors if v in f[0]]
+        if not involved:
+            continue
+        factors = [f for f in factors if v not in f[0]]
+        keep = set(u for (scope, _) in involved for u in scope if u != v)
+        factors.append(multiply(involved, keep))
+    return factors
+
+def variable_elimination(factors, targets, order):
+    """sum out the variables in order, then return the normalized joint factor
+    over targets, with axes in the same order as targets.
+    """
+    scope, table = multiply(eliminate(factors, order), targets)
+    total = table.sum()
+    if total <= 0:
+        raise ValueError("evidence has zero probability.")
+    table = np.transpose(table, [scope.index(t) for t in targets])
+    return table / total
@@ -0,0 +1,195 @@
+"""
+opt-in instrumentation of basilisk's hot paths.
+
+fit, sampling, inference and structure learning report their stages and
+counters here. nothing is recorded unless a Profiler is active, and when none
+is, each hook costs one global lookup. for example:
+
+with instrument.Profiler(memory=True) as prof:
+    model.fit(obs)
+    model.generate_samples(wet, 10000)
+prof.to_dict()  # wall time, calls and bytes per stage, and counters
+prof.to_chrome_trace("trace.json")  # open in chrome://tracing or perfetto
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+_active = None  # the profiler recording, or None when instrumentation is off
+
+class _NullStage(object):
+    """stage used when no profiler is active.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_stage = _NullStage()
+
+class _Stage(object):
+    """times one run of a stage, and tracks the peak memory it allocated.
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler.memory:
+            (current, peak) = tracemalloc.get_traced_memory()
+            if profiler._memory_stack:
+                parent = profiler._memory_stack[-1]
+                parent[1] = max(parent[1], peak)
+            tracemalloc.reset_peak()
+            profiler._memory_stack.append([current, current])
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        profiler = self.profiler
+        allocated = 0
+        if profiler.memory:
+            (start, peak) = profiler._memory_stack.pop()
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            allocated = peak - start
+            if profiler._memory_stack:
+                parent = profiler._memory_stack[-1]
+                parent[1] = max(parent[1], peak)
+            tracemalloc.reset_peak()
+        profiler._record(self.name, self.start, end, allocated)
+        return False
+
+class Profiler(object):
+    """
+    records stages and counters reported by basilisk while it is active, ie
+    inside a with block.
+
+    parameters
+    ----------
+    memory : bool
+        if True, tracemalloc traces allocations, and each stage records the
+        peak number of bytes it allocated above what was in use when it
+        started. tracing slows python allocations down noticeably.
+
+    callbacks : list
+        functions called as callback(name, seconds, bytes) whenever a stage
+        ends, eg to forward timings to a metrics system.
+
+
+    attributes
+    ----------
+    stages : dictionary
+        key represents stage name, value is a dict of 'calls', 'seconds' and
+        'bytes' (the largest allocation of any call).
+
+    counters : dictionary
+        key represents counter name, value is its total. for example,
+        'cpt_builds', 'samples_drawn', 'ci_tests' and 'ci_tests_cached'.
+    """
+
+    def __init__(self, memory=False, callbacks=None):
+        self.memory = memory
+        self.callbacks = list(callbacks or [])
+        self.stages = {}
+        self.counters = {}
+        self._events = []
+        self._memory_stack = []
+        self._previous = None
+        self._started_tracing = False
+        self._origin = time.perf_counter()
+
+    def __enter__(self):
+        global _active
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._previous = _active
+        _active = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self._previous
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def _record(self, name, start, end, allocated):
+        seconds = end - start
+        stats = self.stages.setdefault(name, {"calls": 0, "seconds": 0., "bytes": 0})
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        stats["bytes"] = max(stats["bytes"], allocated)
+        self._events.append((name, start, seconds, allocated, threading.get_ident()))
+        for callback in self.callbacks:
+            callback(name, seconds, allocated)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        """return the stages and counters recorded so far.
+        """
+        return {"stages": dict((k, dict(v)) for (k, v) in self.stages.items()),
+                "counters": dict(self.counters)}
+
+    def to_chrome_trace(self, path=None):
+        """return the recorded stages in the chrome trace event format, with
+        counters as a final counter event, and write them to path if given.
+        """
+        pid = os.getpid()
+        events = []
+        for (name, start, seconds, allocated, tid) in self._events:
+            events.append({"name": name, "ph": "X", "pid": pid, "tid": tid,
+                           "ts": (start - self._origin) * 1e6, "dur": seconds * 1e6,
+                           "args": {"bytes": allocated}})
+        if self.counters:
+            end = max([e["ts"] + e["dur"] for e in events] or [0.])
+            events.append({"name": "counters", "ph": "C", "pid": pid, "tid": 0,
+                           "ts": end, "args": dict(self.counters)})
+
+        trace = {"traceEvents": events, "displayTimeUnit": "ms"}
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(trace, f)
+        return trace
+
+def stage(name):
+    """return a context manager that records a stage on the active profiler,
+    or does nothing if there is none.
+    """
+    if _active is None:
+        return _null_stage
+    return _active.stage(name)
+
+def count(name, n=1):
+    """add n to a counter on the active profiler, if there is one.
+    """
+    if _active is not None:
+        _active.count(name, n)
+
+def timed(name):
+    """decorator that records every call of a function as a stage.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,165 @@
+"""
+gibbs sampling over a fitted BN, with chains run across worker processes.
+"""
+
+import numpy as np
+from .parallel import pool_map
+
+_model = None  # compiled model, set once per worker process
+
+def compile_model(bn):
+    """return a picklable description of a fitted BN for gibbs sampling.
+
+    nodes are referred to by their position in a topological order. for each
+    node, blanket lists the factors needed to resample it from its markov
+    blanket (see BN.markov_blanket()): its own cpt and the cpts of the 
+    members of its blanket that are its children.
+    """
+    order = bn.topological_order
+    names = [n.name for n in order]
+    position = dict((name, i) for (i, name) in enumerate(names))
+
+    families = [[position[p] for p in n.parents_names] + [i] for (i, n) in enumerate(order)]
+    tables = [n.table for n in order]  # sparse cpts are indexed as they are
+    blankets = [[i] + [position[m] for m in bn.markov_blanket(name) 
+                       if name in bn.dict_nodes[m].parents_names]
+                for (i, name) in enumerate(names)]
+    return {"names": names, "cards": [len(n.states) for n in order],
+            "families": families, "tables": tables, "blankets": blankets}
+
+def _set_model(model):
+    """pool initializer: keep the compiled model in the worker.
+    """
+    global _model
+    _model = model
+
+def _initial_state(model, evidence, rng, max_tries=1000):
+    """forward sample a starting state with evidence clamped, retrying until
+    the state has nonzero probability.
+    """
+    for _ in range(max_tries):
+        state = np.zeros(len(model["names"]), dtype=np.intp)
+        weight = 1.
+        for (i, family) in enumerate(model["families"]):
+            p = model["tables"][i][tuple(state[family[:-1]])]
+            if i in evidence:
+                state[i] = evidence[i]
+                weight *= p[state[i]]
+            else:
+                state[i] = np.searchsorted(np.cumsum(p), rng.random() * p.sum(), side='right')
+                state[i] = min(state[i], len(p) - 1)
+        if weight > 0:
+            return state
+    raise ValueError("could not find a state consistent with the evidence.")
+
+def _conditional(model, state, i):
+    """return the distribution of node i given its markov blanket.
+    """
+    p = np.ones(model["cards"][i])
+    for f in model["blankets"][i]:
+        family = model["families"][f]
+        index = tuple(slice(None) if v == i else state[v] for v in family)
+        p = p * model["tables"][f][index]
+    return p
+
+def run_chain(evidence, n_samples, burn_in, thin, seed):
+    """run one gibbs chain with the worker's compiled model and return an
+    array of state codes of shape (n_samples, n_nodes).
+
+    evidence is a dict, where k = node position and v = state code. seed is a
+    np.random.SeedSequence, so chains draw from independent streams.
+    """
+    model = _model
+    rng = np.random.default_rng(seed)
+    state = _initial_state(model, evidence, rng)
+    free = [i for i in range(len(state)) if i not in evidence]
+
+    draws = np.empty((n_samples, len(state)), dtype=np.intp)
+    for sweep in range(burn_in + n_samples * thin):
+        for i in free:
+            p = _conditional(model, state, i)
+            u = rng.random() * p.sum()
+            state[i] = min(np.searchsorted(np.cumsum(p), u, side='right'), len(p) - 1)
+
+        kept = sweep - burn_in
+        if kept >= 0 and (kept + 1) % thin == 0:
+            draws[kept // thin] = state
+    return draws
+
+def gibbs(model, evidence, n_samples, n_chains, burn_in, thin, n_jobs=None, random_state=None):
+    """run n_chains gibbs chains, each in its own worker process, and return
+    an array of state codes of shape (n_chains, n_samples, n_nodes).
+    """
+    seeds = np.random.SeedSequence(random_state).spawn(n_chains)
+    tasks = [(evidence, n_samples, burn_in, thin, seed) for seed in seeds]
+    chains = pool_map(run_chain, tasks, n_jobs, initializer=_set_model, initargs=(model,))
+    return np.stack(chains)
+
+def rhat(chains):
+    """split r-hat for a scalar quantity, given an array of shape (n_chains,
+    n_samples). each chain is split in half, so a chain that drifts is
+    detected as disagreeing with itself.
+    """
+    half = chains.shape[1] // 2
+    splits = np.concatenate([chains[:, :half], chains[:, half:2 * half]])
+    n = splits.shape[1]
+
+    within = splits.var(axis=1, ddof=1).mean()
+    between = n * splits.mean(axis=1).var(ddof=1)
+    if within == 0:
+        return np.nan
+    return np.sqrt(((n - 1.) / n * within + between / n) / within)
+
+def ess(chains):
+    """effective sample size for a scalar quantity, given an array of shape
+    (n_chains, n_samples).
+
+    autocorrelations are averaged over chains, and summed in pairs until a
+    pair sum turns negative (geyer's initial positive sequence).
+    """
+    (m, n) = chains.shape
+    centered = chains - chains.mean(axis=1, keepdims=True)
+    variance = centered.var(axis=1).mean()
+    if variance == 0:
+        return np.nan
+
+    # autocovariance of each chain via fft, averaged over chains
+    size = 2 ** int(np.ceil(np.log2(2 * n)))
+    spectrum = np.fft.rfft(centered, size, axis=1)
+    acov = np.fft.irfft(spectrum * np.conj(spectrum), size, axis=1)[:, :n] / n
+    rho = acov.mean(axis=0) / variance
+
+    tau = -1.
+    for t in range(0, n - 1, 2):
+        pair = rho[t] + rho[t + 1]
+        if pair < 0:
+            break
+        tau += 2 * pair
+    return m * n / max(tau, 1. / np.log10(m * n + 10))
+
+def diagnostics(chains, cards, names, evidence):
+    """return a dict, where k = node name and v = a dict of 'rhat' and 'ess'.
+
+    each state of a node is tracked as an indicator; the worst r-hat and the
+    smallest effective sample size across its states are reported. evidence
+    nodes are fixed, so they are skipped.
+    """
+    results = {}
+    for (i, name) in enumerate(names):
+        if i in evidence:
+            continue
+        # a binary node's two indicators carry the same information
+        states = [1] if cards[i] == 2 else range(cards[i])
+        rhats = []
+        sizes = []
+        for s in states:
+            indicator = (chains[:, :, i] == s).astype(float)
+            rhats.append(rhat(indicator))
+            sizes.append(ess(indicator))
+
+        # a state that never changes (eg, it has probability 0) has no spread
+        rhats = [r for r in rhats if not np.isnan(r)]
+        sizes = [e for e in sizes if not np.isnan(e)]
+        results[name] = {"rhat": max(rhats) if rhats else np.nan,
+                         "ess": min(sizes) if sizes else np.nan}
+    return results
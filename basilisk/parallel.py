@@ -0,0 +1,71 @@
+"""
+helpers for running work across a pool of worker processes.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+def n_workers(n_jobs, n_tasks=None):
+    """return the number of worker processes to use. n_jobs=None or -1 uses
+    every cpu, and there are never more workers than tasks.
+    """
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    if n_tasks is not None:
+        n_jobs = min(n_jobs, n_tasks)
+    return max(1, n_jobs)
+
+class WorkerPool(object):
+    """
+    a pool of worker processes that can be mapped over several times, eg once
+    per level of a search. with one worker, everything runs in the calling
+    process.
+
+    initializer is called once per worker with initargs, which lets large
+    read-only objects (eg a compiled model or an encoded dataset) be pickled
+    once per worker rather than once per task. when everything runs in the
+    calling process, close() calls initializer again with None for each of
+    initargs, so the objects aren't kept alive by module globals.
+    """
+
+    def __init__(self, n_jobs=1, initializer=None, initargs=()):
+        self.workers = n_workers(n_jobs)
+        self.executor = None
+        self.reset = None
+        if self.workers == 1:
+            if initializer is not None:
+                initializer(*initargs)
+                self.reset = (initializer, (None,)*len(initargs))
+        else:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=initializer,
+                                                initargs=initargs)
+
+    def map(self, func, tasks):
+        """return [func(*task) for task in tasks], in order.
+        """
+        if self.executor is None:
+            return [func(*task) for task in tasks]
+        futures = [self.executor.submit(func, *task) for task in tasks]
+        return [f.result() for f in futures]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.reset is not None:
+            initializer, initargs = self.reset
+            self.reset = None
+            initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def pool_map(func, tasks, n_jobs=1, initializer=None, initargs=()):
+    """return [func(*task) for task in tasks], in order, using a WorkerPool
+    with no more workers than tasks.
+    """
+    tasks = list(tasks)
+    with WorkerPool(n_workers(n_jobs, len(tasks)), initializer, initargs) as pool:
+        return pool.map(func, tasks)
@@ -0,0 +1,146 @@
+"""
+batched forward sampling over a compiled execution plan, split into shards that
+can run across worker processes.
+"""
+
+import numpy as np
+from .parallel import pool_map
+from .tables import SparseTable, row_index
+
+_plan = None  # compiled plan, set once per worker process
+
+def compile_plan(execution_order):
+    """return a picklable plan for sampling the nodes in execution_order.
+
+    for each node, the plan keeps the positions of its parents in the plan,
+    the shape of its parent configurations, its cpt as (n_parent
+    configurations, n_states) probability and cumulative distribution arrays,
+    and the keys of its rows. rows are laid out in mixed-radix order of the 
+    parents' state codes, so the row for a batch of parent codes is found with
+    np.ravel_multi_index. a sparse cpt (see tables.SparseTable) only has rows 
+    for its stored configurations, plus its default row last, and keys lists 
+    the configuration of each stored row; dense cpts have no keys.
+    """
+    names = [node.name for node in execution_order]
+    position = dict((name, i) for (i, name) in enumerate(names))
+
+    steps = []
+    for node in execution_order:
+        table = node.table
+        if isinstance(table, SparseTable):
+            probs = np.vstack([table.rows, table.default[None, :]])
+            keys = table.keys
+        else:
+            probs = table.reshape(-1, len(node.states))
+            keys = None
+        cdf = np.cumsum(probs, axis=1)
+        cdf[:, -1] = 1.  # guard against rounding so every draw lands in a state
+        parents = [position[p] for p in node.parents_names]
+        steps.append((parents, table.shape[:-1], probs, cdf, keys))
+    return {"names": names, "steps": steps}
+
+def sample(plan, n_samples, rng, evidence=None):
+    """sample n_samples joint states of the nodes in a plan.
+
+    the plan is walked once. for each node, the cdf row selected by its
+    parents' already-drawn codes is looked up, and all n_samples states are
+    drawn in one vectorized inverse-cdf step.
+
+    evidence nodes (a dict, where k = position in the plan and v = state code)
+    are clamped to their observed state instead of drawn, and each sample's
+    likelihood weight is multiplied by the probability of that state given the
+    sample's parents. returns an array of state codes of shape (n_samples,
+    n_nodes) and the array of weights.
+    """
+    evidence = evidence or {}
+    codes = np.empty((n_samples, len(plan["names"])), dtype=np.intp)
+    weights = np.ones(n_samples)
+
+    for (i, (parents, shape, probs, cdf, keys)) in enumerate(plan["steps"]):
+
+        # marginal nodes only have a single row in their cpt
+        if not parents:
+            rows = np.zeros(n_samples, dtype=np.intp)
+        else:
+            rows = np.ravel_multi_index(codes[:, parents].T, shape)
+        if keys is not None:
+            rows = row_index(keys, rows)  # sparse cpts store some rows only
+
+        if i in evidence:
+            weights *= probs[rows, evidence[i]]
+            codes[:, i] = evidence[i]
+            continue
+
+        # inverse cdf: a draw's state is the number of cdf entries below it
+        u = rng.random(n_samples)
+        codes[:, i] = (cdf[rows] <= u[:, None]).sum(axis=1)
+
+    return codes, weights
+
+def rejection_sample(plan, n_samples, rng, evidence, max_draws=10**8, max_cells=2**24):
+    """draw batches of forward samples and keep those that agree with the
+    evidence, until n_samples are accepted, or raise a ValueError after 
+    max_draws samples. batch sizes follow the observed acceptance rate, but a
+    batch never holds more than about max_cells codes and cdf entries, so 
+    rare evidence does not need huge batches.
+    """
+    accepted = []
+    n_accepted = 0
+    n_drawn = 0
+    width = len(plan["names"]) + max(cdf.shape[1] for (_, _, _, cdf, _) in plan["steps"])
+    max_batch = max(max_cells // width, 1)
+    batch_size = min(n_samples, max_batch)
+
+    while n_accepted < n_samples:
+        if n_drawn >= max_draws:
+            raise ValueError("evidence was not observed in {} draws.".format(n_drawn))
+
+        codes, _ = sample(plan, batch_size, rng)
+        keep = np.ones(batch_size, dtype=bool)
+        for (i, code) in evidence.items():
+            keep &= codes[:, i] == code
+        accepted.append(codes[keep])
+
+        n_drawn += batch_size
+        n_accepted += keep.sum()
+        rate = max(n_accepted, 1) / float(n_drawn)
+        batch_size = int(min(max((n_samples - n_accepted) / rate, 1000), max_batch))
+
+    return np.concatenate(accepted)[:n_samples]
+
+def _set_plan(plan):
+    """pool initializer: keep the compiled plan in the worker.
+    """
+    global _plan
+    _plan = plan
+
+def sample_shard(n_samples, seed, evidence, method, max_draws):
+    """sample one shard with the worker's plan, drawing from the stream of a
+    np.random.SeedSequence. returns state codes and weights.
+    """
+    rng = np.random.default_rng(seed)
+    if method == "rejection":
+        return rejection_sample(_plan, n_samples, rng, evidence, max_draws), np.ones(n_samples)
+    return sample(_plan, n_samples, rng, evidence)
+
+def sample_shards(plan, n_samples, evidence=None, method="likelihood_weighting",
+                  n_jobs=1, random_state=None, shard_size=100000, max_draws=10**8):
+    """sample n_samples joint states in shards of shard_size, spread over
+    n_jobs worker processes. with rejection sampling, each shard may draw its
+    share of max_draws samples.
+
+    shard i always draws from the i-th stream spawned from random_state, and
+    shards are concatenated in order, so a given random_state gives the same
+    samples whatever n_jobs is.
+    """
+    sizes = [shard_size] * (n_samples // shard_size)
+    if n_samples % shard_size or not sizes:
+        sizes.append(n_samples % shard_size)
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+
+    tasks = [(size, seed, evidence, method, max(max_draws * size // max(n_samples, 1), 1)) 
+             for (size, seed) in zip(sizes, seeds)]
+    shards = pool_map(sample_shard, tasks, n_jobs, initializer=_set_plan, initargs=(plan,))
+    codes = np.concatenate([c for (c, _) in shards])
+    weights = np.concatenate([w for (_, w) in shards])
+    return codes, weights
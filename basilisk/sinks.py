@@ -0,0 +1,111 @@
+"""
+sinks stream batches of samples (eg from BN.iter_samples()) to disk, so large
+synthetic datasets are written without holding them in memory.
+"""
+
+import os
+import numpy as np
+from tqdm import tqdm
+from . import instrument
+
+@instrument.timed("write_samples")
+def write_samples(batches, path, n_samples=None, format=None, progress=True):
+    """write an iterable of dataframe batches to path, one batch at a time, and
+    return the number of rows written.
+
+    format is 'csv', 'npy' or 'parquet', and is inferred from path's extension
+    when not given. 'npy' writes a structured array through a memory map, so 
+    n_samples (the total number of rows) must be known upfront and columns must
+    be boolean or numeric. 'parquet' requires pyarrow.
+
+    if progress is True, a progress bar reports rows written and throughput as
+    each batch lands.
+    """
+    format = format or os.path.splitext(path)[1].lstrip(".").lower()
+    writers = {"csv": _CSVWriter, "npy": _NPYWriter, "parquet": _ParquetWriter}
+    if format not in writers:
+        raise ValueError("format must be one of 'csv', 'npy' or 'parquet'.")
+
+    writer = writers[format](path, n_samples)
+    bar = tqdm(total=n_samples, unit="rows", unit_scale=True, disable=not progress)
+    n_written = 0
+    try:
+        for batch in batches:
+            writer.write(batch)
+            n_written += len(batch)
+            bar.update(len(batch))
+    finally:
+        bar.close()
+        writer.close()
+
+    if n_samples is not None and n_written != n_samples:
+        raise ValueError("wrote {} rows, but expected {}.".format(n_written, n_samples))
+    return n_written
+
+class _CSVWriter(object):
+    """append batches to a csv, writing the header with the first batch.
+    """
+
+    def __init__(self, path, n_samples):
+        self.f = open(path, "w", newline="")
+        self.header = True
+
+    def write(self, batch):
+        batch.to_csv(self.f, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        self.f.close()
+
+class _NPYWriter(object):
+    """fill a memory-mapped structured .npy file, batch by batch.
+    """
+
+    def __init__(self, path, n_samples):
+        if n_samples is None:
+            raise ValueError("writing npy requires n_samples.")
+        self.path = path
+        self.n_samples = n_samples
+        self.array = None
+        self.offset = 0
+
+    def write(self, batch):
+        records = batch.to_records(index=False)
+        if any(records.dtype[name] == object for name in records.dtype.names):
+            raise ValueError("npy requires boolean or numeric states; use csv or parquet.")
+
+        if self.array is None:
+            self.array = np.lib.format.open_memmap(self.path, mode="w+", dtype=records.dtype,
+                                                   shape=(self.n_samples,))
+        self.array[self.offset:self.offset + len(records)] = records
+        self.offset += len(records)
+
+    def close(self):
+        if self.array is not None:
+            self.array.flush()
+            del self.array
+
+class _ParquetWriter(object):
+    """append each batch to a parquet file as a row group.
+    """
+
+    def __init__(self, path, n_samples):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("writing parquet requires pyarrow.")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.writer = None
+
+    def write(self, batch):
+        table = self.pa.Table.from_pandas(batch, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
@@ -1,30 +1,76 @@
 import itertools
-import copy
+import os
+import pickle
+from collections import deque
 import numpy as np
 import pandas as pd
 from scipy import stats
+from scipy.special import gammaln
 from .Node import Node
+from . import encoding
+from .parallel import WorkerPool
+from . import instrument
 
-def calc_mi(depdata, depbins):
+_cache = None  # encoded dataset, set once per worker process
+_ci_cache = None  # ci test cache, set once per worker process
+
+def _histogram_codes(depdata, depbins):
+    """return the bin of each value in each column of depdata, and the table 
+    shape. like np.histogramdd, each column is cut into depbins equal-width 
+    bins over its range, and the last bin includes the column's maximum.
     """
-    inputs:
-        depdata - data for two 'dependent' variables as 2-column numpy array
-        depbins - # of bins for each variable - determines resolution for pdf
-    outputs:
-        mutual information between two 'dependent' variables
+    codes = []
+    cards = []
+    for (column, bins) in zip(np.asarray(depdata, dtype = float).T, depbins):
+        bins = int(bins)
+        low, high = (column.min(), column.max()) if len(column) else (0., 1.)
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        edges = np.linspace(low, high, bins + 1)
+        code = np.searchsorted(edges, column, side = 'right') - 1
+        code[column == edges[-1]] = bins - 1
+        codes.append(code)
+        cards.append(bins)
+    return codes, cards
+
+def _mi_from_counts(counts):
+    """mutual information between the two axes of a 2-d count table.
     """
     eps = 1e-10
 
-    hist, edges = np.histogramdd(depdata, bins=depbins)
-
-    Pxy = hist / depdata.shape[0] # P(X,Y)
+    Pxy = counts / counts.sum() # P(X,Y)
     Px = np.sum(Pxy, axis = 1) # P(X)
     Py = np.sum(Pxy, axis = 0) # P(Y)    
     PxPy = np.outer(Px,Py)
 
-    mi = np.sum(Pxy * np.log((Pxy + eps) / (PxPy + eps)))
-            
-    return mi
+    return np.sum(Pxy * np.log((Pxy + eps) / (PxPy + eps)))
+
+def _cmi_from_counts(counts):
+    """conditional mutual information between the first two axes of a 3-d 
+    count table, given the third.
+    """
+    eps = 1e-10
+
+    Pxyz = counts / counts.sum() #P(X,Y,Z)
+    Pz = np.sum(Pxyz, axis = (0,1)) # P(Z)
+    Pxz = np.sum(Pxyz, axis = 1) # P(X,Z)
+    Pyz = np.sum(Pxyz, axis = 0) # P(Y,Z)    
+
+    lognum = Pz[None, None, :] * Pxyz # P(Z)P(X,Y,Z)
+    logden = Pxz[:, None, :] * Pyz[None, :, :] # P(X,Z)P(Y,Z)
+    
+    return np.sum(Pxyz * np.log((lognum + eps) / (logden + eps) ) )
+
+def calc_mi(depdata, depbins):
+    """
+    inputs:
+        depdata - data for two 'dependent' variables as 2-column numpy array
+        depbins - # of bins for each variable - determines resolution for pdf
+    outputs:
+        mutual information between two 'dependent' variables
+    """
+    codes, cards = _histogram_codes(depdata, depbins)
+    return _mi_from_counts(encoding.count(codes, cards))
 
 def calc_cmi(depdata, depbins, inddata, indbins):
     """
@@ -38,30 +84,180 @@ def calc_cmi(depdata, depbins, inddata, indbins):
         conditional mutual information between two dependent variables conditional
         on a third independent variable
     """
-    eps = 1e-10
     bins = np.concatenate((depbins, indbins))
     data = np.concatenate((depdata, inddata), axis = 1)
 
-    hist, edges = np.histogramdd(data, bins=bins)
+    codes, cards = _histogram_codes(data, bins)
+    return _cmi_from_counts(encoding.count(codes, cards))
 
-    Pxyz = hist / data.shape[0] #P(X,Y,Z)
-    Pz = np.sum(Pxyz, axis = (0,1)) # P(Z)
-    Pxz = np.sum(Pxyz, axis = 1) # P(X,Z)
-    Pyz = np.sum(Pxyz, axis = 0) # P(Y,Z)    
+def _pairwise_entropy(counts, offsets, n):
+    """joint entropy of every pair of columns, from their pairwise counts (see
+    CountCache.pair_counts), including each column with itself, which is its 
+    entropy.
+    """
+    P = counts / float(max(n, 1))
+    plogp = np.where(P > 0, P * np.log(np.where(P > 0, P, 1)), 0)
+    return -np.add.reduceat(np.add.reduceat(plogp, offsets, axis=0), offsets, axis=1)
 
-    lognum = np.empty((Pxyz.shape)) # P(Z)P(X,Y,Z)
-    logden = np.empty((Pxyz.shape)) # P(X,Z)P(Y,Z)
-    for i in range(bins[0]):
-        for j in range(bins[1]):
-            for k in range(bins[2]):
-                lognum[i][j][k] = Pz[k]*Pxyz[i][j][k]
-                logden[i][j][k] = Pxz[i][k]*Pyz[j][k]
+def _mi_from_entropy(joint):
+    marginal = np.diag(joint)  # H(X,X) = H(X)
+    return marginal[:, None] + marginal[None, :] - joint
 
-    cmi = np.sum(Pxyz * np.log((lognum + eps) / (logden + eps) ) )
+@instrument.timed("mi_matrix")
+def mi_matrix(data):
+    """
+    inputs:
+        data - dataframe, where each column is a discrete variable
+    outputs:
+        matrix of mutual information between every pair of columns, as a 
+        dataframe indexed by column names
+
+    every column is one-hot encoded, so a matrix product counts the joint 
+    occurrences of every pair of states. each block of the product is a 
+    pairwise contingency table; its entropy is summed with np.add.reduceat,
+    and MI(X,Y) = H(X) + H(Y) - H(X,Y).
+    """
+    cache = data if isinstance(data, CountCache) else CountCache(data)
+    counts, offsets = cache.pair_counts(cache.columns)
+    mi = _mi_from_entropy(_pairwise_entropy(counts, offsets, cache.n))
+    return pd.DataFrame(mi, index=cache.columns, columns=cache.columns)
+
+def cmi_matrix(data, given):
+    """
+    inputs:
+        data - dataframe, where each column is a discrete variable
+        given - name of the conditioning column
+    outputs:
+        matrix of conditional mutual information between every pair of the 
+        other columns, given the conditioning column, as a dataframe
     
-    return cmi
+    MI(X,Y|C) = sum over c of P(c) MI(X,Y|C=c), where each term is a 
+    mi_matrix over the rows with C=c.
+    """
+    cache = data if isinstance(data, CountCache) else CountCache(data)
+    columns = [c for c in cache.columns if c != given]
 
-def dsep(depvars, indvars, test = 'mi', alpha = 0.05):
+    cmi = np.zeros((len(columns), len(columns)))
+    for c in range(cache.cards[given]):
+        rows = np.flatnonzero(cache.codes[given] == c)
+        if len(rows):
+            counts, offsets = cache.pair_counts(columns, rows)
+            cmi += len(rows) / float(cache.n) * _mi_from_entropy(_pairwise_entropy(counts, offsets, len(rows)))
+    return pd.DataFrame(cmi, index=columns, columns=columns)
+
+class CountCache(object):
+    """
+    encodes each column of a dataset once and caches contingency tables over
+    families of columns, so tests that ask for the same variables again (eg 
+    in pc_basic) do not recount the data.
+
+    parameters
+    ----------
+    data : pandas dataframe or encoding.Dataset
+        each column is a discrete variable. a Dataset's codes are used as 
+        they are.
+
+
+    attributes
+    ----------
+    codes : dictionary
+        key represents column name, value is an array of integer codes.
+
+    cards : dictionary
+        key represents column name, value is its number of states.
+
+    hits, misses : int
+        number of tables served from, and added to, the cache.
+    """
+
+    def __init__(self, data):
+        if not isinstance(data, encoding.Dataset):
+            data = encoding.Dataset(data)
+        self.columns = list(data.columns)
+        self.n = len(data)
+        self.codes = dict((column, data.codes(column)) for column in self.columns)
+        self.cards = dict((column, data.card(column)) for column in self.columns)
+        self.tables = {}
+        self.hits = 0
+        self.misses = 0
+
+    def counts(self, columns):
+        """return the contingency table over columns, with one axis per column
+        in the order given.
+        """
+        key = tuple(sorted(columns))
+        if key in self.tables:
+            self.hits += 1
+            instrument.count("count_tables_cached")
+        else:
+            self.misses += 1
+            instrument.count("count_tables")
+            self.tables[key] = encoding.count([self.codes[c] for c in key], 
+                                              [self.cards[c] for c in key])
+        return np.transpose(self.tables[key], [key.index(c) for c in columns])
+
+    def conditional_counts(self, x, y, z):
+        """return the contingency table of x and y, given the columns in z.
+
+        without z, the table is 2-d. otherwise the z columns are combined into
+        one mixed-radix variable over the combinations that occur, and the 
+        table is 3-d, with that variable last.
+        """
+        if len(z) <= 1:
+            return self.counts([x, y] + list(z))
+
+        key = (tuple(sorted([x, y])), tuple(sorted(z)))
+        if key in self.tables:
+            self.hits += 1
+            instrument.count("count_tables_cached")
+        else:
+            self.misses += 1
+            instrument.count("count_tables")
+            combined, n_codes = encoding.combine([self.codes[c] for c in key[1]], 
+                                                 [self.cards[c] for c in key[1]])
+            self.tables[key] = encoding.count([self.codes[key[0][0]], self.codes[key[0][1]], combined],
+                                              [self.cards[key[0][0]], self.cards[key[0][1]], n_codes])
+        table = self.tables[key]
+        return table if key[0] == (x, y) else np.transpose(table, (1, 0, 2))
+
+    def pair_counts(self, columns, rows=None, chunk_size=2**22):
+        """return the joint counts of every pair of states of columns, as one
+        matrix of contingency tables, and the offset of each column's block.
+        rows, if given, are the indices of the rows to count.
+
+        this is onehot.T @ onehot for the columns one-hot encoded side by 
+        side, accumulated over chunks of about chunk_size cells, so the 
+        one-hot matrix is never built for the whole dataset. counts within a
+        chunk are exact in float32.
+        """
+        offsets = np.cumsum([0] + [self.cards[c] for c in columns])
+        width = offsets[-1]
+        rows = np.arange(self.n) if rows is None else np.asarray(rows)
+        step = int(min(max(chunk_size // max(width, 1), 1), 2**24))
+        
+        counts = np.zeros((width, width))
+        for start in range(0, len(rows), step):
+            chunk = rows[start:start + step]
+            onehot = np.zeros((len(chunk), width), dtype=np.float32)
+            for (i, c) in enumerate(columns):
+                onehot[np.arange(len(chunk)), offsets[i] + self.codes[c][chunk]] = 1.
+            counts += onehot.T.dot(onehot)
+        return counts, offsets[:-1]
+
+def _p_value(counts, n):
+    """p-value of the mutual information test on a contingency table, whose
+    first two axes are the dependent variables and whose optional third axis 
+    is the conditioning variable.
+    """
+    if counts.ndim == 2:
+        chi2 = 2*n*_mi_from_counts(counts)
+        df = (counts.shape[0] - 1) * (counts.shape[1] - 1)
+    else:
+        chi2 = 2*n*_cmi_from_counts(counts)
+        df = (counts.shape[0] - 1) * (counts.shape[1] - 1) * counts.shape[2]
+    return 2*stats.chi2.pdf(chi2, df)
+
+def dsep(depvars, indvars, test = 'mi', alpha = 0.05, cache = None):
     if test == 'mi':
         """
         d-separation test using mutual information
@@ -70,57 +266,158 @@ def dsep(depvars, indvars, test = 'mi', alpha = 0.05):
             indvars - data for N independent variables as N-column dataframe
             test - choice of d-separation test - defaults to mutual information test
             alpha - pvalue threshold for dependence test
+            cache - CountCache over the dataset the columns come from, which
+                serves contingency tables instead of recounting the data
             
         output:
             if p-value(test statistic) > alpha, return true, else return false
             
-        issues:
-            can only handle integer valued data
+        columns may hold any categorical values (bool, str, int). multiple 
+        independent variables are combined into a single variable whose states 
+        are the combinations that occur in the data.
         """
-        depbins = depvars.apply(pd.Series.nunique).values
-        indbins = indvars.apply(pd.Series.nunique).values
-        depdata = depvars.values.astype(int)
-        inddata = indvars.values.astype(int)
-
-        assert len(depbins) == 2
+        assert len(depvars.columns) == 2
         
-        if len(indvars.columns) == 0: #if no independent variables, compute marginal MI
-            mi = calc_mi(depdata, depbins)
+        if cache is None:
+            cache = CountCache(pd.concat([depvars, indvars], axis = 1))
 
-            chi2 = 2*len(depvars)*mi
-            df = (depbins[0] - 1) * (depbins[1] - 1)
-            p_val = 2*stats.chi2.pdf(chi2, df)
-            
-            if p_val > alpha:
-                return True
-            else:
-                return False
-            
-        else: #if more than 0 independent variables, compute conditional MI
-            if len(indvars.columns) > 1: 
-                #if more than 1 independent variable, concatenate them to a product codeword
-                inddata = inddata.astype(str)
-
-                for i in range(len(inddata)):
-                    inddata[i, 0] = ''.join(inddata[i,:len(indbins)])
-                    
-                inddata = inddata.astype(int)[:,0].reshape((len(depvars), 1))
-                indbins = np.array([ len(np.unique(inddata) ) ])
-                
-            cmi = calc_cmi(depdata, depbins, inddata, indbins)
-            
-            chi2 = 2*len(depvars)*cmi
-            df = (depbins[0] - 1) * (depbins[1] - 1) * indbins[0]
-            p_val = 2*stats.chi2.pdf(chi2, df)
-            
-            if p_val > alpha:
-                return True
-            else:
-                return False
+        x, y = depvars.columns
+        return _independent(cache, x, y, list(indvars.columns), alpha)
+
+def _independent(cache, x, y, z, alpha):
+    """return True if x and y are independent given z, by the mutual 
+    information test on the cached contingency table.
+    """
+    counts = cache.conditional_counts(x, y, z)
+    instrument.count("ci_tests")
+    return _p_value(counts, cache.n) > alpha
+
+def _set_cache(cache, ci_cache):
+    """pool initializer: keep the encoded dataset and a snapshot of the ci 
+    test cache in the worker.
+    """
+    global _cache, _ci_cache
+    _cache = cache
+    _ci_cache = ci_cache
+
+def _separate(x, y, candidates_x, candidates_y, n, alpha):
+    """return the first subset of size n of candidates_x, then of 
+    candidates_y, that d-separates x and y, or None if there is none. 
+
+    tests run on the worker's encoded dataset and are looked up in its ci test
+    cache first. also returns the p-values computed here and the number of 
+    cache hits, so the caller can merge them into its cache.
+    """
+    computed = {}
+    hits = 0
+    tried = set()
+    for z in itertools.chain(itertools.combinations(candidates_x, n),
+                             itertools.combinations(candidates_y, n)):
+        key = CITestCache.key(x, y, z)
+        if key in tried:
+            continue
+        tried.add(key)
+
+        p_val = _ci_cache.pvalues.get(key) if _ci_cache is not None else None
+        if p_val is None:
+            p_val = _p_value(_cache.conditional_counts(x, y, list(z)), _cache.n)
+            computed[key] = p_val
+        else:
+            hits += 1
+
+        if p_val > alpha:
+            return z, computed, hits
+    return None, computed, hits
+
+class CITestCache(object):
+    """
+    p-values of conditional independence tests, keyed by (frozenset([x, y]), 
+    frozenset(z)). p-values rather than decisions are kept, so runs with a 
+    different alpha reuse them. a cache can be saved to disk and loaded to 
+    resume an interrupted or repeated pc_basic run on the same data.
+
+    parameters
+    ----------
+    fingerprint : str
+        identifies the dataset the tests were run on.
+
+
+    attributes
+    ----------
+    pvalues : dictionary
+        key represents a test, value is its p-value.
 
-def pc_basic(data):
+    hits, misses : int
+        number of tests served from, and added to, the cache.
     """
-    path condition algorithm (spirtes 2nd ed 5.4.2)
+
+    def __init__(self, fingerprint=None):
+        self.fingerprint = fingerprint
+        self.pvalues = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(x, y, z):
+        return (frozenset([x, y]), frozenset(z))
+
+    @staticmethod
+    def fingerprint_of(data):
+        """return a hash of a dataset's columns and values, from its codes and
+        states, so a dataframe and its encoding.Dataset hash alike.
+        """
+        if not isinstance(data, encoding.Dataset):
+            data = encoding.Dataset(data)
+
+        # codes are renumbered in sorted state order, which does not depend on
+        # the order states were first seen in
+        codes = {}
+        states = []
+        for c in data.columns:
+            column = data.codes(c)
+            (ls, order) = encoding.sort_states(data.states[c])
+            rank = np.full(len(order) + 1, -1, dtype = np.intp)  # -1 stays missing
+            rank[order] = np.arange(len(order))
+            codes[c] = rank[column]
+            states.append(pd.util.hash_array(np.array(ls, dtype = object)).sum())
+        values = pd.util.hash_pandas_object(pd.DataFrame(codes), index = False).values
+        return "{}:{}:{}:{}".format(list(data.columns), len(data), int(values.sum()), 
+                                    int(np.sum(states, dtype = np.uint64)))
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump({"fingerprint": self.fingerprint, "pvalues": self.pvalues}, f)
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        """load a saved cache. if fingerprint is given and the cache was built
+        on different data, an empty cache is returned instead.
+        """
+        ci_cache = cls(fingerprint)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                saved = pickle.load(f)
+            if fingerprint is None or saved["fingerprint"] == fingerprint:
+                ci_cache.fingerprint = saved["fingerprint"]
+                ci_cache.pvalues = saved["pvalues"]
+        return ci_cache
+
+@instrument.timed("pc_basic")
+def pc_basic(data, alpha = 0.05, n_jobs = 1, ci_cache = None):
+    """
+    path condition algorithm (spirtes 2nd ed 5.4.2), in its order-independent
+    "pc-stable" form (colombo & maathuis 2014)
+    
+    inputs:
+        data - dataframe or encoding.Dataset, where each column is a 
+            discrete variable
+        alpha - pvalue threshold for the d-separation tests
+        n_jobs - number of worker processes that run the tests of a level; 
+            None uses every cpu
+        ci_cache - CITestCache, or a path where one is loaded from (if it 
+            exists and matches data) and checkpointed after every level
+    outputs:
+        list of nodes, wired with the learned parents
     
     pseudo-code:
     
@@ -129,6 +426,7 @@ def pc_basic(data):
     
         n = 0
         repeat:
+            freeze adj(x) for every x
             for each x in graph:
                 for each y in adj(x) s.t. |adj(x) \ y| >= n:
                     for each subset z in adj(x) \ y s.t. |z| = n:
@@ -158,35 +456,64 @@ def pc_basic(data):
         until: no more edges to orient
     """
     
-    labels = data.apply(pd.Series.nunique).index.values
-    graph = dict([(x, [y for y in labels if x!=y]) for x in labels])
-    sepset = dict([(x, []) for x in labels])
-    
-    n = 0
-    stop = False
-    while not stop:
-        for x in labels: #loop through vertices x
-            if len(graph[x]) - 1 >= n: #if |adj(x)| - 1 >= n
-                for y in graph[x]: #loop through adj(x)
-                    adj = copy.deepcopy(graph[x])
-                    adj.remove(y) #define adj(x) \ y
-                    for z in itertools.combinations(adj, n): #loop through adj(x) \ y
-                        if dsep(data[[x, y]], data[list(z)]):
-                            sepset[x] = {y:z} #add z to sepset(x,y)
-                            sepset[y] = {x:z} #add z to sepset(y,x)
-                            
-                            if y in graph[x]: #remove x-y edge
-                                graph[x].remove(y)
-                                graph[y].remove(x)
-                    del adj #probably unecessary
-        n += 1
-        
-        for x in labels:
-            if len(graph[x]) > n - 1:
-                stop = False
-                break
-            else:
-                stop = True
+    if not isinstance(data, encoding.Dataset):
+        data = encoding.Dataset(data)  # each column is encoded once, and shared
+    labels = list(data.columns)
+    order = sorted(labels, key = str) #visit variables by name, not column order
+    graph = dict([(x, [y for y in order if x!=y]) for x in labels])
+    sepset = dict([(x, {}) for x in labels])
+    
+    path = None
+    if ci_cache is None or isinstance(ci_cache, str):
+        path = ci_cache
+        fingerprint = CITestCache.fingerprint_of(data)
+        ci_cache = CITestCache.load(path, fingerprint) if path else CITestCache(fingerprint)
+    
+    # variables associated with both x and y are the likeliest separators, so
+    # they are tried first
+    cache = CountCache(data)
+    strength = mi_matrix(cache).values
+    column = dict((v, i) for (i, v) in enumerate(cache.columns))
+    def ranked(candidates, x, y):
+        (sx, sy) = (strength[column[x]], strength[column[y]])
+        return sorted(candidates, key = lambda v: (-min(sx[column[v]], sy[column[v]]), str(v)))
+    
+    # pc-stable: adjacencies are frozen at the start of each level, so every
+    # test in a level is independent of the others and of column order
+    with WorkerPool(n_jobs, _set_cache, (cache, ci_cache)) as pool:
+        n = 0
+        while any(len(graph[x]) - 1 >= n for x in labels):
+            frozen = dict((x, list(graph[x])) for x in labels)
+            
+            with instrument.stage("pc_basic.level"):
+                tasks = []
+                for (i, x) in enumerate(order): #loop through vertices x
+                    for y in frozen[x]: #loop through adj(x), once per pair
+                        if order.index(y) < i:
+                            continue
+                        adj_x = [v for v in frozen[x] if v != y] #define adj(x) \ y
+                        adj_y = [v for v in frozen[y] if v != x] #define adj(y) \ x
+                        if len(adj_x) >= n or len(adj_y) >= n:
+                            tasks.append((x, y, ranked(adj_x, x, y), ranked(adj_y, x, y), n, alpha))
+            
+                for (task, (z, computed, hits)) in zip(tasks, pool.map(_separate, tasks)):
+                    ci_cache.pvalues.update(computed)
+                    ci_cache.hits += hits
+                    ci_cache.misses += len(computed)
+                    instrument.count("ci_tests", len(computed))
+                    instrument.count("ci_tests_cached", hits)
+                
+                    (x, y) = task[:2]
+                    if z is None:
+                        continue
+                    sepset[x][y] = z #add z to sepset(x,y)
+                    sepset[y][x] = z #add z to sepset(y,x)
+                    graph[x].remove(y) #remove x-y edge
+                    graph[y].remove(x)
+            n += 1
+            
+            if path:
+                ci_cache.save(path) #checkpoint, so an interrupted run can resume
     
     dgraph = dict([(x,[]) for x in graph.keys()]) #initialize empty directed graph
 
@@ -217,3 +544,296 @@ def pc_basic(data):
         child.ls_parents = parents
         
     return nodelist
+
+class FamilyScores(object):
+    """
+    decomposable network scores, cached per family. a network's score is the
+    sum of its families' scores, so a search move that changes one family's
+    parents only needs that family rescored.
+
+    parameters
+    ----------
+    data : pandas dataframe, encoding.Dataset or CountCache
+        each column is a discrete variable.
+
+    score : str
+        'bic', or 'bdeu' with equivalent sample size ess.
+
+
+    attributes
+    ----------
+    scores : dictionary
+        key represents a family as (child, frozenset of parents), value is its
+        score.
+
+    hits, misses : int
+        number of family scores served from, and added to, the cache.
+    """
+
+    def __init__(self, data, score = 'bic', ess = 1.):
+        if score not in ('bic', 'bdeu'):
+            raise ValueError("score must be 'bic' or 'bdeu'.")
+        self.cache = data if isinstance(data, CountCache) else CountCache(data)
+        self.score = score
+        self.ess = float(ess)
+        self.scores = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, x, parents):
+        key = (x, frozenset(parents))
+        if key in self.scores:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.scores[key] = self._score(x, sorted(key[1], key = str))
+        return self.scores[key]
+
+    def _score(self, x, parents):
+        """score one family from its counts, with a row per parent 
+        configuration that occurs in the data.
+        """
+        cache = self.cache
+        r = cache.cards[x]
+        q = int(np.prod([cache.cards[p] for p in parents]))
+        if parents:
+            configs, n_configs = encoding.combine([cache.codes[p] for p in parents],
+                                                  [cache.cards[p] for p in parents])
+            counts = encoding.count([configs, cache.codes[x]], [n_configs, r])
+        else:
+            counts = cache.counts([x])[None, :]
+        totals = counts.sum(axis = 1)
+
+        if self.score == 'bic':
+            ratio = np.where(counts > 0, counts / np.maximum(totals, 1)[:, None], 1)
+            return (counts * np.log(ratio)).sum() - 0.5 * np.log(cache.n) * q * (r - 1)
+
+        # parent configurations that never occur contribute nothing to bdeu
+        a_j = self.ess / q
+        a_jk = a_j / r
+        return ((gammaln(a_j) - gammaln(a_j + totals)).sum() 
+                + (gammaln(a_jk + counts) - gammaln(a_jk)).sum())
+
+def _descendants(parents, order):
+    """return a dict, where k = variable and v = the set of its descendants.
+    variables on a cycle are left out.
+    """
+    children = dict((x, []) for x in order)
+    for x in order:
+        for p in parents[x]:
+            children[p].append(x)
+
+    # visit children before parents
+    indegree = dict((x, len(parents[x])) for x in order)
+    topological = [x for x in order if not indegree[x]]
+    for x in topological:
+        for c in children[x]:
+            indegree[c] -= 1
+            if not indegree[c]:
+                topological.append(c)
+
+    descendants = {}
+    for x in reversed(topological):
+        descendants[x] = set(children[x])
+        for c in children[x]:
+            descendants[x] |= descendants[c]
+    return descendants
+
+@instrument.timed("hill_climb")
+def hill_climb(data, score = 'bic', ess = 1., max_parents = None, whitelist = None, 
+               blacklist = None, tabu_length = 0, max_iter = 1000, scores = None):
+    """
+    greedy search over dags for the network with the best score, by adding, 
+    deleting and reversing one edge at a time.
+    
+    inputs:
+        data - dataframe or encoding.Dataset, where each column is a 
+            discrete variable
+        score - 'bic' or 'bdeu'
+        ess - equivalent sample size of the bdeu prior
+        max_parents - largest number of parents a variable may have
+        whitelist - list of (parent, child) edges the network must have
+        blacklist - list of (parent, child) edges the network must not have
+        tabu_length - when positive, the search keeps going past local optima 
+            with the best move that does not undo one of the last tabu_length 
+            moves, and stops after tabu_length moves without improvement
+        max_iter - largest number of moves
+        scores - FamilyScores to reuse between searches over the same data
+    outputs:
+        list of nodes, wired with the learned parents
+    
+    each move changes the parents of one family (two, for a reversal), so 
+    only the moves into that family are rescored; every other move's change 
+    in score is kept from earlier iterations.
+    """
+    if scores is None:
+        scores = FamilyScores(data, score, ess)
+    (hits, misses) = (scores.hits, scores.misses)
+    labels = list(data.columns)
+    whitelist = set(tuple(e) for e in (whitelist or []))
+    blacklist = set(tuple(e) for e in (blacklist or []))
+    if max_parents is None:
+        max_parents = len(labels) - 1
+
+    parents = dict((x, set()) for x in labels)
+    for (p, x) in whitelist:
+        parents[x].add(p)
+    if len(_descendants(parents, labels)) < len(labels):
+        raise ValueError("whitelist has a cycle.")
+
+    def family_moves(x):
+        """return a dict of the change in score of every move into x, where 
+        k = (parent, child, 'add' or 'delete').
+        """
+        current = scores(x, parents[x])
+        moves = {}
+        for p in labels:
+            if p == x:
+                continue
+            if p in parents[x]:
+                if (p, x) not in whitelist:
+                    moves[(p, x, 'delete')] = scores(x, parents[x] - set([p])) - current
+            elif (p, x) not in blacklist and len(parents[x]) < max_parents:
+                moves[(p, x, 'add')] = scores(x, parents[x] | set([p])) - current
+        return moves
+
+    deltas = dict((x, family_moves(x)) for x in labels)
+    total = sum(scores(x, parents[x]) for x in labels)
+    best = (total, dict((x, set(parents[x])) for x in labels))
+    tabu = deque(maxlen = max(tabu_length, 1))
+    stale = 0
+
+    for _ in range(max_iter):
+        descendants = _descendants(parents, labels)
+        candidates = []
+        for x in labels:
+            for ((p, c, kind), delta) in deltas[x].items():
+                if kind == 'add':
+                    if p not in descendants[c]:  # c already reaches p
+                        candidates.append((delta, (p, c, kind)))
+                    continue
+                candidates.append((delta, (p, c, kind)))
+
+                # reversing p -> c adds c -> p, if p has no other path to c
+                reverse = deltas[p].get((c, p, 'add'))
+                if reverse is None:
+                    continue
+                if any(q in descendants[p] for q in parents[c] if q != p):
+                    continue
+                candidates.append((delta + reverse, (p, c, 'reverse')))
+
+        # highest gain first; ties go to the earliest variables by name
+        candidates = [m for m in candidates if m[1] not in tabu]
+        if not candidates:
+            break
+        (delta, (p, c, kind)) = max(candidates, key = lambda m: (m[0], str(m[1][0]), str(m[1][1]), m[1][2]))
+        if delta <= 1e-10 and not tabu_length:
+            break
+
+        if kind == 'add':
+            parents[c].add(p)
+            tabu.append((p, c, 'delete'))
+        elif kind == 'delete':
+            parents[c].remove(p)
+            tabu.append((p, c, 'add'))
+        else:
+            parents[c].remove(p)
+            parents[p].add(c)
+            tabu.append((c, p, 'reverse'))
+        for x in set([p, c]):
+            deltas[x] = family_moves(x)
+
+        total += delta
+        if total > best[0] + 1e-10:
+            best = (total, dict((x, set(parents[x])) for x in labels))
+            stale = 0
+        else:
+            stale += 1
+            if stale >= tabu_length:
+                break
+
+    instrument.count("family_scores", scores.misses - misses)
+    instrument.count("family_scores_cached", scores.hits - hits)
+
+    nodelist = [Node(x) for x in labels]
+    lookup = dict((n.name, n) for n in nodelist)
+    for child in nodelist:
+        child.ls_parents = [lookup[p] for p in labels if p in best[1][child.name]]
+    return nodelist
+
+def _maximum_spanning_tree(weights, root):
+    """return a dict, where k = variable and v = its parent in the maximum 
+    spanning tree of a weight matrix (a dataframe), directed away from root.
+
+    prim's algorithm on the dense matrix: each step adds the variable with the 
+    heaviest edge into the tree.
+    """
+    labels = list(weights.columns)
+    w = weights.values
+    n = len(labels)
+    r = labels.index(root)
+
+    in_tree = np.zeros(n, dtype=bool)
+    in_tree[r] = True
+    best = w[r].astype(float).copy()
+    link = np.full(n, r)
+    parent = {root: None}
+    for _ in range(n - 1):
+        i = int(np.argmax(np.where(in_tree, -np.inf, best)))
+        in_tree[i] = True
+        parent[labels[i]] = labels[link[i]]
+        closer = w[i] > best
+        best = np.where(closer, w[i], best)
+        link = np.where(closer, i, link)
+    return parent
+
+def _tree_nodes(labels, parents):
+    """return a list of nodes, where parents is a dict, where k = variable and 
+    v = a list of its parents.
+    """
+    nodelist = [Node(x) for x in labels]
+    lookup = dict((n.name, n) for n in nodelist)
+    for child in nodelist:
+        child.ls_parents = [lookup[p] for p in parents[child.name]]
+    return nodelist
+
+@instrument.timed("chow_liu")
+def chow_liu(data, root = None):
+    """
+    chow-liu tree: the tree that maximizes the likelihood of the data, which 
+    is the maximum spanning tree weighted by pairwise mutual information.
+    
+    inputs:
+        data - dataframe, where each column is a discrete variable
+        root - the variable edges are directed away from; defaults to the 
+            first column
+    outputs:
+        list of nodes, wired with the learned parents
+    """
+    labels = list(data.columns)
+    root = labels[0] if root is None else root
+    tree = _maximum_spanning_tree(mi_matrix(data), root)
+    return _tree_nodes(labels, dict((x, [] if p is None else [p]) for (x, p) in tree.items()))
+
+@instrument.timed("tan")
+def tan(data, target, root = None):
+    """
+    tree-augmented naive bayes: target is a parent of every other variable, 
+    and the other variables also form a tree, the maximum spanning tree 
+    weighted by mutual information conditioned on target.
+    
+    inputs:
+        data - dataframe, where each column is a discrete variable
+        target - the class variable
+        root - the feature edges are directed away from; defaults to the 
+            first column other than target
+    outputs:
+        list of nodes, wired with the learned parents
+    """
+    labels = list(data.columns)
+    features = [c for c in labels if c != target]
+    root = features[0] if root is None else root
+    tree = _maximum_spanning_tree(cmi_matrix(data, target), root)
+    parents = dict((x, [target] + ([] if p is None else [p])) for (x, p) in tree.items())
+    parents[target] = []
+    return _tree_nodes(labels, parents)
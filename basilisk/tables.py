@@ -0,0 +1,237 @@
+"""
+sparse cpts, which only store the parent configurations that were observed.
+
+a node with many parents, or parents with many states, has far more parent
+configurations than there are observations. a SparseTable keeps one row per
+observed configuration, indexed by its mixed-radix code in a sorted array,
+and a default distribution for every other configuration. the helpers below
+treat dense arrays and SparseTables alike, so fitting can switch a family to
+sparse storage once its dense table would be too large.
+"""
+
+import numpy as np
+from . import encoding
+
+MAX_DENSE_SIZE = 2**22  # families with more cells than this are stored sparse
+
+class SparseTable(object):
+    """
+    a table of shape (parent cardinalities..., cardinality), of which only
+    some rows are stored. it holds counts while fitting and probabilities
+    once compiled.
+
+    parameters
+    ----------
+    shape : tuple
+        shape of the equivalent dense table.
+
+    keys : numpy array
+        sorted, unique mixed-radix codes of the stored parent configurations
+        (see np.ravel_multi_index).
+
+    rows : numpy array
+        of shape (len(keys), cardinality), the stored rows.
+
+    default : numpy array
+        the row of every configuration that is not stored. defaults to zeros.
+    """
+
+    __array_ufunc__ = None  # so numpy defers arithmetic to the methods below
+
+    def __init__(self, shape, keys, rows, default=None):
+        self.shape = tuple(int(s) for s in shape)
+        self.keys = np.asarray(keys, dtype=np.int64)
+        self.rows = np.asarray(rows, dtype=float).reshape(len(self.keys), self.shape[-1])
+        if default is None:
+            default = np.zeros(self.shape[-1])
+        self.default = np.asarray(default, dtype=float)
+
+    @classmethod
+    def from_dense(cls, table):
+        """return the sparse form of a dense table, keeping nonzero rows.
+        """
+        table = np.asarray(table, dtype=float)
+        rows = table.reshape(int(np.prod(table.shape[:-1])), table.shape[-1])
+        keys = np.flatnonzero(rows.any(axis=1))
+        return cls(table.shape, keys, rows[keys])
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        """number of stored cells.
+        """
+        return self.rows.size
+
+    def row_index(self, keys):
+        """return the position of each configuration code in rows, or
+        len(rows) for configurations that are not stored.
+        """
+        return row_index(self.keys, keys)
+
+    def _rows(self, position):
+        """return the rows at positions given by row_index(), with the default
+        row for configurations that are not stored.
+        """
+        stored = position < len(self.keys)
+        rows = np.empty(position.shape + (self.shape[-1],))
+        rows[...] = self.default
+        rows[stored] = self.rows[position[stored]]
+        return rows
+
+    def lookup(self, parent_codes):
+        """return the row of each parent configuration, given one array of
+        codes per parent.
+        """
+        keys = np.ravel_multi_index(tuple(parent_codes), self.shape[:-1])
+        return self._rows(self.row_index(keys))
+
+    def __getitem__(self, index):
+        """index like a dense table, with one code (or array of codes) per 
+        axis. missing trailing axes, and axes indexed with a slice, are kept.
+        slices may only be mixed with single codes, eg to reduce a table by
+        evidence, and only the cells selected are built.
+        """
+        if not isinstance(index, tuple):
+            index = (index,)
+        index = index + (slice(None),) * (self.ndim - len(index))
+        sliced = [axis for (axis, v) in enumerate(index[:-1]) if isinstance(v, slice)]
+        if sliced and any(np.ndim(v) for v in index if not isinstance(v, slice)):
+            raise IndexError("slices can only be mixed with single codes.")
+
+        # sliced parent axes span an open grid, in axis order
+        grid = []
+        for (axis, v) in enumerate(index[:-1]):
+            if isinstance(v, slice):
+                shape = [1] * len(sliced)
+                shape[sliced.index(axis)] = -1
+                grid.append(np.arange(self.shape[axis])[v].reshape(shape))
+            else:
+                grid.append(np.asarray(v))
+        keys = np.asarray(np.ravel_multi_index(tuple(grid), self.shape[:-1]))
+        rows = self._rows(self.row_index(keys.ravel()).reshape(keys.shape))
+
+        last = index[-1]
+        if isinstance(last, slice) or np.ndim(last) == 0:
+            return rows[..., last]
+        shape = np.broadcast(rows[..., 0], last).shape
+        rows = np.broadcast_to(rows, shape + rows.shape[-1:])
+        last = np.broadcast_to(last, shape)
+        return np.take_along_axis(rows, last[..., None], axis=-1)[..., 0]
+
+    def dense(self):
+        """return the equivalent dense table.
+        """
+        table = np.tile(self.default, (int(np.prod(self.shape[:-1])), 1))
+        table[self.keys] = self.rows
+        return table.reshape(self.shape)
+
+    def __array__(self, dtype=None):
+        table = self.dense()
+        return table if dtype is None else table.astype(dtype)
+
+    def pad(self, shape):
+        """return the table zero-padded up to shape, re-coding its keys for
+        the new parent cardinalities.
+        """
+        shape = tuple(int(s) for s in shape)
+        if shape == self.shape:
+            return self
+        codes = np.unravel_index(self.keys, self.shape[:-1])
+        keys = np.ravel_multi_index(codes, shape[:-1]) if len(shape) > 1 else self.keys
+        widths = ((0, 0), (0, shape[-1] - self.shape[-1]))
+        return SparseTable(shape, keys, np.pad(self.rows, widths, mode='constant'),
+                           np.pad(self.default, widths[1], mode='constant'))
+
+    def permute(self, orders):
+        """return the table re-coded so that, on every axis, new code i is old
+        code orders[axis][i], like table[np.ix_(*orders)] for a dense table.
+        """
+        codes = np.unravel_index(self.keys, self.shape[:-1])
+        inverse = [np.argsort(order) for order in orders[:-1]]
+        keys = np.ravel_multi_index(tuple(inv[c] for (inv, c) in zip(inverse, codes)),
+                                    self.shape[:-1])
+        sort = np.argsort(keys)
+        return SparseTable(self.shape, keys[sort], self.rows[sort][:, orders[-1]],
+                           self.default[orders[-1]])
+
+    def normalize(self, pseudo_count=0.):
+        """return the table of counts, plus the pseudo-count, normalized over
+        the last axis. configurations that are not stored, and rows without
+        counts, become uniform.
+        """
+        rows = self.rows + pseudo_count
+        totals = rows.sum(axis=1, keepdims=True)
+        uniform = np.full(self.shape[-1], 1. / self.shape[-1])
+        rows = np.where(totals > 0, rows / np.where(totals > 0, totals, 1), uniform)
+        return SparseTable(self.shape, self.keys, rows, uniform)
+
+    def clip(self, low):
+        return SparseTable(self.shape, self.keys, self.rows.clip(low), self.default.clip(low))
+
+    def __mul__(self, factor):
+        return SparseTable(self.shape, self.keys, self.rows * factor, self.default * factor)
+
+    __rmul__ = __mul__
+
+    def __add__(self, other):
+        """add two sparse tables of the same shape, row by row.
+        """
+        keys = np.union1d(self.keys, other.keys)
+        rows = np.tile(self.default + other.default, (len(keys), 1))
+        rows[np.searchsorted(keys, self.keys)] += self.rows - self.default
+        rows[np.searchsorted(keys, other.keys)] += other.rows - other.default
+        return SparseTable(self.shape, keys, rows, self.default + other.default)
+
+def row_index(keys, configurations):
+    """return the position of each configuration code in a sorted array of 
+    keys, or len(keys) for configurations that are not in it.
+    """
+    configurations = np.asarray(configurations)
+    position = np.searchsorted(keys, configurations)
+    found = position < len(keys)
+    found[found] = keys[position[found]] == configurations[found]
+    return np.where(found, position, len(keys))
+
+def count(codes, cards, max_dense=MAX_DENSE_SIZE):
+    """return a count table of shape cards, like encoding.count(), as a
+    SparseTable if the dense table would have more than max_dense cells.
+    """
+    cards = tuple(int(c) for c in cards)
+    if np.prod(cards, dtype=float) <= max_dense or len(cards) < 2:
+        return encoding.count(codes, cards)
+
+    codes = np.stack(codes)
+    codes = codes[:, (codes >= 0).all(axis=0)]
+    keys = np.ravel_multi_index(tuple(codes[:-1]), cards[:-1])
+    (keys, inverse) = np.unique(keys, return_inverse=True)
+    rows = np.bincount(inverse.ravel() * cards[-1] + codes[-1],
+                       minlength=len(keys) * cards[-1])
+    return SparseTable(cards, keys, rows.reshape(len(keys), cards[-1]))
+
+def pad(table, cards):
+    """return a dense or sparse table zero-padded up to shape cards.
+    """
+    if isinstance(table, SparseTable):
+        return table.pad(cards)
+    return encoding.pad(table, cards)
+
+def add(a, b, scale=1.):
+    """return a + scale * b, padding both to a common shape. the result is
+    sparse if either table is.
+    """
+    shape = np.maximum(a.shape, b.shape)
+    if isinstance(a, SparseTable) or isinstance(b, SparseTable):
+        a = a if isinstance(a, SparseTable) else SparseTable.from_dense(a)
+        b = b if isinstance(b, SparseTable) else SparseTable.from_dense(b)
+    return pad(a, shape) + scale * pad(b, shape)
+
+def permute(table, orders):
+    """return a dense or sparse table re-coded so that, on every axis, new
+    code i is old code orders[axis][i].
+    """
+    if isinstance(table, SparseTable):
+        return table.permute(orders)
+    return table[np.ix_(*orders)]
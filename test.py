@@ -1,5 +1,9 @@
+import os
+import pickle
+import tempfile
 import unittest
 from basilisk import Node, BN
+from basilisk import instrument, sampling, tables
 import numpy as np
 import pandas as pd
 
@@ -33,6 +37,35 @@ class Test_Basilisk(unittest.TestCase):
 
         self.assertEqual(correct_sequence, computed_sequence)
 
+    def test_scheduler_graph_changes(self):
+        """assert plans are topological when breadth first order is not, are 
+        rebuilt when parents change, and that cycles are reported.
+        """
+        A = Node("A")
+        B = Node("B", [A])
+        C = Node("C", [A, B])
+        model = BN([C, B, A])
+        self.assertEqual([n.name for n in model.scheduler(C)], ["A", "B", "C"])
+        self.assertEqual(model.dict_children["A"], ["C", "B"])
+
+        self.assertEqual(model.markov_blanket(B), ["A", "C"])
+        Node("D", [A])  # a node outside the network keeps its plans
+        self.assertIn("C", model._plans)
+
+        B.ls_parents = []
+        self.assertEqual(model.dict_children["A"], ["C"])
+        self.assertEqual(model.markov_blanket(B), ["C", "A"])
+        self.assertEqual(model.ancestors(C), frozenset(["A", "B", "C"]))
+
+        # an unpickled network still hears about its nodes' changes
+        copy = pickle.loads(pickle.dumps(model))
+        copy.dict_nodes["B"].ls_parents = [copy.dict_nodes["A"]]
+        self.assertEqual(copy.dict_children["A"], ["C", "B"])
+
+        A.ls_parents = [C]
+        with self.assertRaises(ValueError):
+            model.scheduler(C)
+
     def test_sample(self):
         """assert distribution from directly sampling nodes matches distribution
         from joint observations.
@@ -57,5 +90,399 @@ class Test_Basilisk(unittest.TestCase):
         b = np.array(leaf_node.cpt[False])
         self.assertTrue(np.allclose(a, b, atol=.05))  # atol = absolute difference
 
+    def test_generate_samples(self):
+        """assert batched samples are typed and match a non-marginal cpt.
+        """
+        C = Node("cloudy")
+        R = Node("rain", [C])
+        S = Node("sprinkler", [C])
+        W = Node("wet", [R, S])
+        model = BN([C, R, S, W])
+        obs = pd.read_csv("data/observations.csv").drop("Unnamed: 0", axis=1)
+        model.fit(obs)
+
+        samples = model.generate_samples(W, n_samples=20000)
+        self.assertEqual(list(samples.columns), ["cloudy", "sprinkler", "rain", "wet"])
+        self.assertTrue(all(samples.dtypes == bool))
+
+        joint_obs = pd.crosstab([samples["rain"], samples["sprinkler"]], samples["wet"], normalize = 'index')
+        self.assertTrue(np.allclose(joint_obs[True].values, W.cpt[True].values, atol=.05))
+
+    def test_generate_samples_reproducible(self):
+        """assert a random_state gives identical samples for any n_jobs.
+        """
+        self.model.fit(pd.read_csv("data/obs_v3.csv"))
+        serial = self.model.generate_samples(self.W, n_samples=150000, random_state=7)
+        parallel = self.model.generate_samples(self.W, n_samples=150000, random_state=7, n_jobs=2)
+        self.assertTrue(serial.equals(parallel))
+
+        other = self.model.generate_samples(self.W, n_samples=150000, random_state=8)
+        self.assertFalse(serial.equals(other))
+
+    def test_iter_samples(self):
+        """assert streamed batches cover n_samples and round-trip through the
+        csv and npy sinks.
+        """
+        from basilisk.sinks import write_samples
+
+        self.model.fit(pd.read_csv("data/obs_v3.csv"))
+        batches = list(self.model.iter_samples(self.W, 2500, batch_size=1000, random_state=0))
+        self.assertEqual([len(b) for b in batches], [1000, 1000, 500])
+        samples = pd.concat(batches, ignore_index=True)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "samples.csv")
+            write_samples(iter(batches), path, progress=False)
+            self.assertTrue(pd.read_csv(path).equals(samples))
+
+            path = os.path.join(tmp, "samples.npy")
+            write_samples(iter(batches), path, n_samples=2500, progress=False)
+            self.assertTrue((np.load(path)["W"] == samples["W"].values).all())
+
+    def test_specify_cpt(self):
+        """assert a specified cpt compiles into a table indexed by the parents'
+        state codes, and that the dataframe view round-trips.
+        """
+        R = Node("rain")
+        S = Node("sprinkler")
+        W = Node("wet", [R, S])
+        R.specify_cpt({'True': [.2]})
+        S.specify_cpt({'True': [.4]})
+        W.specify_cpt({'rain':      [False, False, True, True],
+                       'sprinkler': [False, True, False, True],
+                       'True':      [0, .9, .8, .99]})
+
+        self.assertEqual(W.states, [False, True])
+        self.assertEqual(W.table.shape, (2, 2, 2))
+        self.assertAlmostEqual(W.table[R.state_codes[True], S.state_codes[False], W.state_codes[True]], .8)
+        self.assertTrue(np.allclose(W.cpt[True].values, [0, .9, .8, .99]))
+        self.assertIn(W.sample([True, True])[0], [False, True])
+
+    def test_dataset(self):
+        """assert samples encoded as a Dataset fit the same cpts as the decoded
+        dataframe, and that a cpt may have any number of states.
+        """
+        self.model.fit(pd.read_csv("data/obs_v3.csv"))
+        frame = self.model.generate_samples(self.W, 5000, random_state=0)
+        dataset = self.model.generate_samples(self.W, 5000, random_state=0, as_dataset=True)
+        self.assertTrue(dataset.to_frame().equals(frame))
+
+        self.model.fit(dataset)
+        expected = self.W.table.copy()
+        self.model.fit(frame)
+        self.assertTrue(np.allclose(self.W.table, expected))
+
+        X = Node("X")
+        Y = Node("Y", [X])
+        X.specify_cpt({"lo": [.2], "mid": [.3], "hi": [.5]})
+        Y.specify_cpt({"X": ["lo", "mid", "hi"], "True": [.1, .5, .9]})
+        self.assertEqual(X.states, ["hi", "lo", "mid"])
+        self.assertAlmostEqual(Y.table[X.state_codes["mid"], Y.state_codes[True]], .5)
+        with self.assertRaises(ValueError):
+            Y.specify_cpt({"X": ["lo"], "Z": ["hi"], "True": [.5]})
+
+    def test_query(self):
+        """assert variable elimination matches brute force enumeration of the
+        joint distribution.
+        """
+        obs = pd.read_csv("data/obs_v3.csv")
+        self.model.fit(obs)
+        nodes = self.model.ls_nodes
+
+        # joint distribution as the product of every node's cpt
+        joint = np.ones([2] * len(nodes))
+        names = [n.name for n in nodes]
+        for states in np.ndindex(*joint.shape):
+            for n in nodes:
+                index = tuple(states[names.index(p)] for p in n.parents_names + [n.name])
+                joint[states] *= n.table[index]
+
+        # P(A | W=True, T=False)
+        evidence = joint[:, :, :, 0][..., 1, :]  # axes: B, A, C, R, S
+        expected = evidence.sum(axis=(0, 2, 3, 4))
+        expected = expected / expected.sum()
+
+        posterior = self.model.query("A", {self.W: True, "T": False})
+        self.assertTrue(np.allclose(posterior["prob"].values, expected))
+        self.assertAlmostEqual(self.model.query([self.R, "S"])["prob"].sum(), 1.)
+
+    def test_junction_tree(self):
+        """assert junction tree marginals match variable elimination as the
+        evidence changes.
+        """
+        self.model.fit(pd.read_csv("data/obs_v3.csv"))
+        jt = self.model.compile_junction_tree()
+
+        for evidence in [{}, {"W": True}, {"W": True, "T": False}, {"W": False}]:
+            jt.set_evidence(evidence)
+            marginals = jt.marginals()
+            for name in ["B", "A", "C", "S"]:
+                expected = self.model.query(name, evidence)["prob"].values
+                self.assertTrue(np.allclose(marginals[name]["prob"].values, expected))
+
+    def test_sample_with_evidence(self):
+        """assert likelihood weighting and rejection sampling approximate the
+        exact posterior.
+        """
+        self.model.fit(pd.read_csv("data/obs_v3.csv"))
+        evidence = {self.W: True, "T": True}
+        expected = self.model.query("A", evidence)["prob"].values[1]
+
+        samples, weights = self.model.generate_samples(self.W, n_samples=50000, evidence=evidence)
+        self.assertTrue(samples["W"].all())
+        self.assertAlmostEqual(np.average(samples["A"], weights=weights), expected, delta=.02)
+
+        samples, weights = self.model.generate_samples(self.W, n_samples=10000, evidence=evidence, method="rejection")
+        self.assertEqual(len(samples), 10000)
+        self.assertTrue((samples["T"] & samples["W"]).all())
+        self.assertAlmostEqual(samples["A"].mean(), expected, delta=.03)
+
+        # small batches still reach n_samples, and the draws are bounded
+        plan = sampling.compile_plan(self.model.scheduler(self.W))
+        codes = sampling.rejection_sample(plan, 100, np.random.default_rng(0), 
+                                          {plan["names"].index("W"): 1}, max_cells=100)
+        self.assertEqual(len(codes), 100)
+        with self.assertRaises(ValueError):
+            self.model.generate_samples(self.W, n_samples=10000, evidence=evidence, 
+                                        method="rejection", max_draws=100)
+
+    def test_gibbs(self):
+        """assert gibbs chains approximate the exact posterior, report 
+        diagnostics, and do not depend on how chains are spread over workers.
+        """
+        self.model.fit(pd.read_csv("data/obs_v3.csv"))
+        evidence = {self.W: True, "T": True}
+        expected = self.model.query("A", evidence)["prob"].values[1]
+
+        samples, diagnostics = self.model.gibbs(evidence, n_samples=3000, n_chains=2, 
+                                                burn_in=100, n_jobs=1, random_state=0)
+        self.assertEqual(len(samples), 6000)
+        self.assertAlmostEqual(samples["A"].mean(), expected, delta=.03)
+        self.assertNotIn("W", diagnostics)
+        self.assertLess(diagnostics["A"]["rhat"], 1.05)
+
+        parallel, _ = self.model.gibbs(evidence, n_samples=3000, n_chains=2, 
+                                       burn_in=100, n_jobs=2, random_state=0)
+        self.assertTrue(samples.equals(parallel))
+
+    def test_fit_chunks(self):
+        """assert fitting from a csv path, one chunk at a time, matches fitting
+        from a dataframe.
+        """
+        obs = pd.read_csv("data/obs_v3.csv")
+        self.model.fit(obs)
+        expected = dict((n.name, n.table) for n in self.model.ls_nodes)
+
+        self.model.fit("data/obs_v3.csv", chunksize=64)
+        for n in self.model.ls_nodes:
+            self.assertEqual(n.states, [False, True])
+            self.assertTrue(np.allclose(n.table, expected[n.name]))
+
+        self.model.fit(pd.read_csv("data/obs_v3.csv", chunksize=300))
+        self.assertTrue(np.allclose(self.W.table, expected["W"]))
+
+        # refitting straight after a lazy fit discards the families it never
+        # counted, rather than counting them from the old observations
+        for observations in ["data/obs_v3.csv", pd.read_csv("data/obs_v3.csv", chunksize=300)]:
+            self.model.fit(obs)
+            self.model.fit(observations)
+            self.assertEqual(self.model.counts["W"].sum(), len(obs))
+            self.assertTrue(np.allclose(self.W.table, expected["W"]))
+
+        self.model.fit(obs)
+        self.model.window = 2
+        self.model.fit(obs)
+        self.assertEqual(self.model.counts["W"].sum(), len(obs))
+
+    def test_partial_fit(self):
+        """assert partial fits over batches match a full fit, that a window 
+        forgets old batches, and that pseudo-counts smooth unseen rows.
+        """
+        obs = pd.read_csv("data/obs_v3.csv")
+        self.model.fit(obs)
+        expected = self.W.table.copy()
+
+        model = BN(self.model.ls_nodes)
+        for i in range(0, len(obs), 250):
+            model.partial_fit(obs.iloc[i:i + 250])
+        self.assertTrue(np.allclose(self.W.table, expected))
+
+        model = BN(self.model.ls_nodes, window=2)
+        for i in range(0, len(obs), 250):
+            model.partial_fit(obs.iloc[i:i + 250])
+        self.assertEqual(model.counts["W"].sum(), 500)
+
+        model = BN(self.model.ls_nodes, pseudo_count=1.)
+        model.fit(obs[~(obs["R"] & obs["S"])])
+        self.assertTrue(np.allclose(self.W.table[1, 1], [.5, .5]))
+        self.assertFalse(np.isnan(self.W.table).any())
+
+    def test_instrument(self):
+        """assert a profiler records stages, counters and allocations while it
+        is active, and nothing afterwards.
+        """
+        obs = pd.read_csv("data/obs_v3.csv")
+        ended = []
+        with instrument.Profiler(memory=True, callbacks=[lambda *args: ended.append(args)]) as prof:
+            self.model.fit(obs)
+            self.model.generate_samples(self.W, 1000, random_state=0)
+        self.model.generate_samples(self.W, 1000, random_state=0)
+
+        report = prof.to_dict()
+        self.assertEqual(report["stages"]["fit"]["calls"], 1)
+        self.assertEqual(report["stages"]["generate_samples"]["calls"], 1)
+        self.assertEqual(report["stages"]["fit.family"]["calls"], 7)
+        self.assertGreater(report["stages"]["fit.family"]["bytes"], 0)
+        self.assertEqual(report["counters"]["cpt_builds"], 7)
+        self.assertEqual(report["counters"]["samples_drawn"], 1000)
+        self.assertEqual(len(ended), sum(s["calls"] for s in report["stages"].values()))
+
+        trace = prof.to_chrome_trace()
+        self.assertEqual([e["name"] for e in trace["traceEvents"] if e["ph"] == "X"], 
+                         [name for (name, _, _) in ended])
+
+    def test_save_load(self):
+        """assert a saved and memory-mapped model matches the fitted one.
+        """
+        obs = pd.read_csv("data/obs_v3.csv")
+        self.model.fit(obs)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "model")
+            self.model.save(path)
+
+            loaded = BN.load(path)
+            self.assertEqual([n.name for n in loaded.topological_order], 
+                             [n.name for n in self.model.topological_order])
+            W = loaded.dict_nodes["W"]
+            self.assertEqual(W.parents_names, ["R", "S"])
+            self.assertEqual(W.states, [False, True])
+            self.assertTrue(np.allclose(W.table, self.W.table))
+            self.assertFalse(W.table.flags.writeable)  # a view of the mapped file
+            self.assertTrue(np.allclose(loaded.query("W", {"C": True})["prob"],
+                                        self.model.query("W", {"C": True})["prob"]))
+
+            # saved counts let a loaded model keep learning
+            loaded.partial_fit(obs.head(3))
+            self.model.partial_fit(obs.head(3))
+            for node in self.model.ls_nodes:
+                self.assertTrue(np.allclose(loaded.dict_nodes[node.name].table, node.table))
+
+    def test_lazy_fit(self):
+        """assert cpts are fit on first access, and that only families whose
+        parents or columns changed are refit.
+        """
+        obs = pd.read_csv("data/obs_v3.csv")
+        self.model.fit(obs)
+        self.assertEqual(self.model.counts, {})
+
+        self.model.generate_samples(self.R, 10)  # fits R and its ancestors only
+        self.assertEqual(sorted(self.model.counts), ["A", "B", "C", "R", "T"])
+        expected = self.R.table.copy()
+        
+        # new parents refit one family
+        S = self.model.dict_nodes["S"]
+        S.ls_parents = []
+        self.assertTrue(S._stale and not self.R._stale)
+        self.assertTrue(np.allclose(S.table, obs["S"].value_counts(normalize=True).sort_index()))
+
+        # refitting with one column changed keeps every other family
+        changed = obs.assign(W=~obs["W"])
+        self.model.fit(changed)
+        self.assertTrue(self.W._stale and not self.R._stale)
+        self.assertTrue(np.allclose(self.R.table, expected))
+        self.assertTrue(np.allclose(self.W.table[..., 0], 1 - self.W.table[..., 1]))
+
+    def test_score_samples(self):
+        """assert row log-probabilities match the cpts, marginalize missing 
+        values, and agree between dataframes and chunked csvs.
+        """
+        obs = pd.read_csv("data/obs_v3.csv")
+        self.model.fit(obs)
+        scores = self.model.score_samples(obs)
+
+        row = obs.iloc[0]
+        expected = sum(np.log(n.table[tuple(p.state_codes[row[p.name]] for p in n.ls_parents + [n])])
+                       for n in self.model.ls_nodes)
+        self.assertAlmostEqual(scores[0], expected)
+        self.assertAlmostEqual(self.model.log_likelihood("data/obs_v3.csv", chunksize=128), scores.sum())
+
+        # only W observed, and W missing in every other row
+        partial = obs[["W"]].astype(object)
+        partial.iloc[1::2, 0] = np.nan
+        marginal = self.model.query("W").set_index("W")["prob"]
+        scores = self.model.score_samples(partial)
+        self.assertAlmostEqual(scores[0], np.log(marginal[obs["W"][0]]))
+        self.assertTrue(np.allclose(scores[1::2], 0.))
+
+        self.assertEqual(self.model.score_samples(obs.head(1).assign(W="wet"))[0], -np.inf)
+
+    def test_predict(self):
+        """assert batched posteriors match query(), are cached across calls,
+        and are recomputed after a refit.
+        """
+        obs = pd.read_csv("data/obs_v3.csv")
+        self.model.fit(obs)
+        rows = obs.astype(object)
+        rows.loc[::2, "C"] = np.nan
+        rows = rows.drop(columns=["T"])
+
+        probs = self.model.predict_proba(rows, "C")
+        evidence = dict((k, rows.iloc[0][k]) for k in ["B", "A", "R", "W", "S"])
+        self.assertTrue(np.allclose(probs.iloc[0].values, self.model.query("C", evidence)["prob"]))
+
+        predictions = self.model.predict(rows, ["C", "R"])
+        self.assertEqual(list(predictions.columns), ["C", "R"])
+        self.assertEqual(predictions["C"][0], [False, True][probs.iloc[0].values.argmax()])
+        filled = rows.fillna(predictions)
+        self.assertFalse(filled["C"].isna().any())
+
+        other = Node("other")
+        other.specify_cpt({"True": [.5]})  # another network's changes keep the cache
+        BN([other])
+        with instrument.Profiler() as prof:
+            self.model.predict_proba(rows, "C")
+        self.assertNotIn("posteriors", prof.counters)
+
+        self.model.fit(obs.iloc[:500])
+        with instrument.Profiler() as prof:
+            self.model.predict_proba(rows, "C")
+        self.assertGreater(prof.counters["posteriors"], 0)
+
+    def test_sparse(self):
+        """assert sparse cpts sample, score, query and save like dense ones,
+        and that a default only stores the listed configurations.
+        """
+        obs = pd.read_csv("data/obs_v3.csv")
+        self.model.fit(obs)
+        dense = dict((n.name, n.table) for n in self.model.topological_order)
+        samples = self.model.generate_samples(self.W, 1000, random_state=0)
+        scores = self.model.score_samples(obs)
+        posterior = self.model.query("W", {"C": True})["prob"]
+
+        self.setUp()
+        self.model.max_dense_size = 4  # R and W have 8 cells
+        self.model.fit(obs)
+        self.assertIsInstance(self.W.table, tables.SparseTable)
+        self.assertTrue(np.allclose(np.asarray(self.W.table), dense["W"]))
+        self.assertTrue(samples.equals(self.model.generate_samples(self.W, 1000, random_state=0)))
+        self.assertTrue(np.allclose(self.model.score_samples(obs), scores))
+        self.assertTrue(np.allclose(self.model.query("W", {"C": True})["prob"], posterior))
+        jt = self.model.compile_junction_tree()
+        jt.set_evidence({"C": True})
+        self.assertTrue(np.allclose(jt.marginals()["W"]["prob"], posterior))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "model")
+            self.model.save(path)
+            W = BN.load(path).dict_nodes["W"]
+            self.assertIsInstance(W.table, tables.SparseTable)
+            self.assertTrue(np.allclose(np.asarray(W.table), dense["W"]))
+
+        self.W.specify_cpt({"R": [True], "S": [True], "True": [.99]}, default=.1)
+        self.assertEqual(len(self.W.table.keys), 1)
+        self.assertEqual(len(self.W.cpt), 1)
+        self.assertTrue(np.allclose(self.W.table[0, 1], [.9, .1]))
+        self.assertTrue(np.allclose(self.W.table[1, 1], [.01, .99]))
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file